@@ -0,0 +1,184 @@
+# Core Imports
+from __future__ import unicode_literals
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from pivotal_tools.concurrency import imap_concurrently
+
+ARCHIVE_VERSION = 1
+
+# Stories created at the same time while importing
+MAX_IMPORTS = 4
+
+
+class ArchiveError(Exception):
+    """the archive is not one we wrote, or it is damaged"""
+
+
+def story_to_dict(story):
+    return {
+        'story_id': story.story_id,
+        'project_id': story.project_id,
+        'name': story.name,
+        'description': story.description,
+        'owned_by': story.owned_by,
+        'story_type': story.story_type,
+        'estimate': story.estimate,
+        'state': story.state,
+        'url': story.url,
+        'labels': story.labels,
+        'notes': [{'note_id': note.note_id, 'text': note.text,
+                   'author': note.author} for note in story.notes],
+        'tasks': [{'task_id': task.task_id, 'description': task.description,
+                   'complete': task.complete} for task in story.tasks],
+        'attachments': [{'attachment_id': attachment.attachment_id,
+                         'description': attachment.description,
+                         'url': attachment.url}
+                        for attachment in story.attachments],
+    }
+
+
+def _line(record):
+    return (json.dumps(record, sort_keys=True, separators=(',', ':'))
+            + '\n').encode('utf-8')
+
+
+def export_project(project, path, stories=None):
+    """Streams the stories of a project into a gzipped JSONL archive, one
+    record at a time.
+
+    The archive starts with a header record, and ends with a manifest
+    holding the number of stories and the sha256 of their records.  It is
+    written to a temporary file and moved in place when complete.  Returns
+    the manifest
+    """
+    if stories is None:
+        stories = project.all_stories(lazy=True)
+
+    checksum = hashlib.sha256()
+    count = 0
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wb') as out:
+        out.write(_line({'type': 'header', 'version': ARCHIVE_VERSION,
+                         'created_at': time.time(),
+                         'project': {'project_id': project.project_id,
+                                     'name': project.name,
+                                     'point_scale': project.point_scale}}))
+        for story in stories:
+            line = _line(dict(story_to_dict(story), type='story'))
+            checksum.update(line)
+            out.write(line)
+            count += 1
+
+        manifest = {'type': 'manifest', 'stories': count,
+                    'sha256': checksum.hexdigest()}
+        out.write(_line(manifest))
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+    return manifest
+
+
+def read_archive(path):
+    """Yields the story records of an archive one at a time, checking the
+    manifest once the last one was read.  Raises ArchiveError if it does not
+    match"""
+    checksum = hashlib.sha256()
+    count = 0
+    manifest = None
+    with gzip.open(path, 'rb') as archive:
+        header = json.loads(archive.readline().decode('utf-8') or '{}')
+        if header.get('type') != 'header':
+            raise ArchiveError('{} is not a pivotal_tools archive'.format(path))
+        if header.get('version') != ARCHIVE_VERSION:
+            raise ArchiveError('{} is a version {} archive, expected {}'.format(
+                path, header.get('version'), ARCHIVE_VERSION))
+
+        for line in archive:
+            record = json.loads(line.decode('utf-8'))
+            if record.get('type') == 'manifest':
+                manifest = record
+                break
+            checksum.update(line)
+            count += 1
+            yield record
+
+    if manifest is None:
+        raise ArchiveError('{} is truncated, it has no manifest'.format(path))
+    if manifest['stories'] != count or manifest['sha256'] != checksum.hexdigest():
+        raise ArchiveError('{} does not match its manifest'.format(path))
+
+
+def verify_archive(path):
+    """reads through the whole archive, and returns the number of stories"""
+    count = 0
+    for _ in read_archive(path):
+        count += 1
+    return count
+
+
+def story_payload(record):
+    """the create_story payload that recreates an archived story"""
+    story = {'name': record['name'], 'story_type': record['story_type']}
+    for key in ['description', 'labels']:
+        if record.get(key):
+            story[key] = record[key]
+    if record.get('state'):
+        story['current_state'] = record['state']
+    if record.get('estimate') is not None and record['estimate'] >= 0:
+        story['estimate'] = record['estimate']
+    return {'story': story}
+
+
+class ImportProgress(object):
+    """Append-only list of the archived story ids already imported, so an
+    interrupted import can resume.  Ids can be added from any thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.done = set(line.decode('utf-8').strip() for line in f)
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def add(self, story_id):
+        with self._lock:
+            self._file.write('{}\n'.format(story_id).encode('utf-8'))
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def import_archive(project, path, max_imports=MAX_IMPORTS):
+    """Replays an archive into a project with create_story, max_imports at a
+    time.  The archive is verified first.  Stories imported by an earlier,
+    interrupted run are skipped.
+
+    Yields (record, error) for every story it tried to create.  A story is
+    recorded as imported as soon as it is created, not when it is yielded,
+    so stories created ahead of an interruption are not created twice
+    """
+    verify_archive(path)
+
+    progress = ImportProgress(path + '.progress')
+    try:
+        records = (record for record in read_archive(path)
+                   if record['story_id'] not in progress.done)
+
+        def create(record):
+            project.create_story(story_payload(record))
+            progress.add(record['story_id'])
+
+        for record, _, error in imap_concurrently(create, records, max_imports):
+            yield record, error
+    finally:
+        progress.close()
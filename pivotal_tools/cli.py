@@ -7,6 +7,21 @@ A collection of tools to help with your pivotal workflow
 changelog
 ---------------
 List out projects stories that are delivered or finished (not accepted)
+Every changelog saves a snapshot of the stories it saw (named with the
+_snapshot_ option, `last` by default).  Pass a snapshot name or file with the
+_since_ option to only list what changed since then
+
+all projects
+---------------
+Changelog, show stories and scrum can report on every project at once.  The
+projects are fetched in parallel and merged into one report, grouped by project.
+Pass the `all-projects` option to use it
+
+format
+---------------
+Changelog, show stories and scrum can write one machine readable record per
+story, as jsonl, csv or tsv, instead of the report.  The records are streamed
+out as the stories arrive
 
 show stories
 ---------------
@@ -16,7 +31,9 @@ By default show the top 20 stories, can specify more (or less) with the _number_
 
 show story
 ---------------
-Show the details for a given story.  passing the project-index parameter will make it faster
+Show the details for the given stories, or for the story ids read from stdin
+when there are none.  The stories are fetched together, one request per project,
+and shown in the order given.  passing the project-index parameter will make it faster
 
 open
 ---------------
@@ -34,16 +51,86 @@ create (feature|bug|chore)
 ---------------
 Create a story
 
+export
+---------------
+Back up every story of a project (with its notes, tasks and attachment links)
+to a compressed archive
+
+import
+---------------
+Recreate the stories of an archive in a project.  An interrupted import picks
+up where it left off when run again
+
+download attachments
+---------------
+Download the attachments of the given stories, or of every story in a project
+with the `all` option.  Interrupted downloads are resumed, and files that did
+not change are skipped
+
+queue (aka offline)
+---------------
+Creating stories, changing their state and estimating them in poker can be
+recorded in a local journal instead of being sent right away.  This is instant,
+and works without a network.  Pass the `queue` or `offline` option to use it
+
+flush
+---------------
+Send the changes recorded in the local journal to pivotal
+
+listen
+---------------
+Run a local endpoint for pivotal activity web hooks, to keep the stories the
+tool has cached (for search) current without polling.  Point a project's
+activity web hook at http://<host>:<port>/
+
+stats
+---------------
+Velocity statistics for a project: points by state, owner and label, how the
+estimates are distributed, how many features are unestimated and how many bugs
+there are per feature
+
+search
+---------------
+Search the names, descriptions, labels, notes and tasks of every story the tool
+has fetched, across all projects.  Works from a local index, without the
+network.  End a term with * to match every word starting with it.  Stories
+fetched in bulk (by stats, export, `download attachments --all` and the
+`format` option) are not indexed
+
+completion
+---------------
+Print a bash or zsh completion script, to complete story ids, project indexes
+and owner initials.  Load it from your shell's startup file with
+`eval "$(pivotal_tools completion bash)"`.  Completions come from a small
+index of the recently fetched stories, refreshed after every command, so they
+are instant and work without a network
+
+record and replay
+---------------
+Pass the `record` option to save every request a command makes, with its
+response, to a cassette file.  Run the command again with the `replay` option to
+answer the requests from the cassette instead, without a network or a token.
+The `latency` option slows the replayed responses down, to reproduce a slow
+session
+
 
 Usage:
-  pivotal_tools create (feature|bug|chore) <title> [<description>] [--project-index=<pi>]
-  pivotal_tools (start|finish|deliver|accept|reject) story <story_id> [--project-index=<pi>]
-  pivotal_tools show stories [--project-index=<pi>] [--for=<user_name>] [--number=<number_of_stories>]
-  pivotal_tools show story <story_id> [--project-index=<pi>]
-  pivotal_tools open <story_id> [--project-index=<pi>]
-  pivotal_tools changelog [--project-index=<pi>]
-  pivotal_tools scrum [--project-index=<pi>] [--show-finished] [--show-delivered]
-  pivotal_tools (planning|poker) [--project-index=<pi>]
+  pivotal_tools create (feature|bug|chore) <title> [<description>] [--project-index=<pi>] [--queue | --offline] [options]
+  pivotal_tools (start|finish|deliver|accept|reject) story <story_id> [--project-index=<pi>] [--queue | --offline] [options]
+  pivotal_tools flush [options]
+  pivotal_tools search <terms>... [--number=<number_of_stories>]
+  pivotal_tools listen [--host=<host>] [--port=<port>]
+  pivotal_tools completion (bash|zsh)
+  pivotal_tools show stories [--project-index=<pi> | --all-projects] [--for=<user_name>] [--number=<number_of_stories>] [--format=<format>] [options]
+  pivotal_tools show story [<story_ids>...] [--project-index=<pi>] [options]
+  pivotal_tools open <story_id> [--project-index=<pi>] [options]
+  pivotal_tools changelog [--project-index=<pi> | --all-projects] [--since=<snapshot>] [--snapshot=<name>] [--format=<format>] [options]
+  pivotal_tools scrum [--project-index=<pi> | --all-projects] [--show-finished] [--show-delivered] [--format=<format>] [options]
+  pivotal_tools (planning|poker) [--project-index=<pi>] [--queue | --offline] [options]
+  pivotal_tools stats [--project-index=<pi>] [options]
+  pivotal_tools export [--project-index=<pi>] [--output=<archive>] [options]
+  pivotal_tools import <archive> [--project-index=<pi>] [options]
+  pivotal_tools download attachments (<story_ids>... | --all) [--project-index=<pi>] [--dest=<dir>] [options]
 
 Options:
   -h --help             Show this screen.
@@ -52,32 +139,84 @@ Options:
                         the project shows up in my prompt. This is useful if
                         you do not want to be prompted, and then you can pipe
                         the output
+  --all-projects        Report on every project, fetched in parallel
+  --host=<host>         Address to listen on [default: 127.0.0.1]
+  --port=<port>         Port to listen on [default: 8765]
+  --since=<snapshot>    Only list the changes since a changelog snapshot, by
+                        name (`last` is the previous changelog) or file
+  --snapshot=<name>     Name of the snapshot this changelog saves [default: last]
+  --format=<format>     Stream one record per story instead of the report,
+                        as jsonl, csv or tsv
+  --queue               Record the change in the local journal, to be sent
+                        later with `flush`
+  --offline             Same as --queue
+  --all                 Every story in the project
+  --dest=<dir>          Directory to download to [default: attachments]
+  --output=<archive>    File to export to, project-<id>.jsonl.gz by default
   --show-finished       Show finished (but undelivered) stories, if your
                         workflow requires this
   --show-delivered      Show delivered stories, if your workflow requires this
+  --record=<cassette>   Record the requests of the command, and their responses,
+                        into a cassette file
+  --replay=<cassette>   Answer the requests of the command from a cassette,
+                        without a network
+  --latency=<ms>        With --replay, how long each response takes [default: 0]
 
 """
 
 #Core Imports
 from __future__ import unicode_literals
+import atexit
+import json
 import os
 import sys
 import webbrowser
-from itertools import islice
+from itertools import chain, islice
 
 
 #3rd Party Imports
-from docopt import docopt
-from termcolor import colored
-
-from pivotal_tools.pivotal import Project, Story, InvalidStateException
+from docopt import docopt, parse_defaults
+
+from pivotal_tools.pivotal import (
+    Project, Story, InvalidStateException, PROJECT_LISTENERS, STORY_LISTENERS,
+    get_transport, set_transport)
+from pivotal_tools.concurrency import (
+    imap_concurrently, Prefetch, WriteBehindQueue)
+from pivotal_tools.journal import Journal, flush
+from pivotal_tools.render import (
+    COLOR, PLAIN, initials, terminal_size, write_lines)
+from pivotal_tools.formats import FORMATS, story_record, write_records
+from pivotal_tools.search import SearchIndex
+from pivotal_tools.stats import project_stats
+from pivotal_tools.snapshot import (
+    Snapshot, SnapshotError, snapshot_path, changed_stories)
+from pivotal_tools.download import download_attachments
+from pivotal_tools.archive import export_project, import_archive
+from pivotal_tools.webhook import make_server
+from pivotal_tools.storage import data_path, write_atomically
+from pivotal_tools.transport import RecordingTransport, ReplayTransport
+from pivotal_tools.completion import CompletionIndex, completion_script
 
 
 ## Main Methods
 
 
+# Row layouts, shared by every row of a report
+CHANGELOG_FEATURE_ROW = '    * {:14s} {}'.format
+CHANGELOG_STORY_ROW = '* {:14s} {}'.format
+STORIES_ROW = '{:14s}{:4s}{:9s}{:13s}{:10s} {}'.format
+STORY_TITLE_ROW = '{:12s}{:4s}{:9s}{:10s} {}'.format
+SCRUM_STORY_ROW = '   #{:12s}{:9s} {:7s} {}'.format
+SCRUM_BUG_ROW = '   #{:12s} {:4s} {}'.format
+SEARCH_ROW = '{:14s}{:4s}{:9s}{:13s} {}'.format
+STATS_ROW = '   {:20s} {:6d}'.format
+
+# Story ids fetched with one request by show story
+STORY_BATCH_SIZE = 100
+
 
-def generate_changelog(project):
+def generate_changelog(project, finished_features, finished_bugs, known_issues,
+                       style=COLOR):
     """Generate a Changelog for the current project.  It is grouped into 3 sections:
     * New Features
     * Bugs Fixed
@@ -85,18 +224,19 @@ def generate_changelog(project):
 
     The new features section is grouped by label for easy comprehension
     """
+    bold = style.bold
+    lines = []
 
     title_string = 'Change Log {}'.format(project.name)
 
-    print('')
-    print(bold(title_string))
-    print(bold('=' * len(title_string)))
-    print('')
+    lines.append('')
+    lines.append(bold(title_string))
+    lines.append(bold('=' * len(title_string)))
+    lines.append('')
 
-    print(bold('New Features'))
-    print(bold('============'))
+    lines.append(bold('New Features'))
+    lines.append(bold('============'))
 
-    finished_features = project.finished_features()
     features_by_label = group_stories_by_label(finished_features)
 
     for label in features_by_label:
@@ -104,12 +244,12 @@ def generate_changelog(project):
             display_label = 'Other'
         else:
             display_label = label
-        print(bold(display_label.title()))
+        lines.append(bold(display_label.title()))
         for story in features_by_label[label]:
-            print('    * {:14s} {}'.format('[{}]'.format(
+            lines.append(CHANGELOG_FEATURE_ROW('[{}]'.format(
                 story.story_id), story.name))
 
-    def print_stories(stories):
+    def story_lines(stories):
         if len(stories) > 0:
             for story in stories:
                 story_string = ""
@@ -117,23 +257,23 @@ def generate_changelog(project):
                     story_string += "[{}] ".format(story.labels)
 
                 story_string += story.name
-                print('* {:14s} {}'.format(
+                lines.append(CHANGELOG_STORY_ROW(
                     '[{}]'.format(story.story_id), story_string))
         else:
-            print('None')
-            print('')
+            lines.append('None')
+            lines.append('')
 
-    print('')
-    print(bold('Bugs Fixed'))
-    print(bold('=========='))
-    print_stories(project.finished_bugs())
+    lines.append('')
+    lines.append(bold('Bugs Fixed'))
+    lines.append(bold('=========='))
+    story_lines(finished_bugs)
 
-    print('')
-    print(bold('Known Issues'))
-    print(bold('=========='))
-    print_stories(project.known_issues())
+    lines.append('')
+    lines.append(bold('Known Issues'))
+    lines.append(bold('=========='))
+    story_lines(known_issues)
 
-    print('')
+    return lines
 
 
 def show_stories(stories, arguments):
@@ -158,7 +298,7 @@ def show_stories(stories, arguments):
         lines.append("None")
     else:
         for story in islice(stories, number_of_stories):
-            lines.append('{:14s}{:4s}{:9s}{:13s}{:10s} {}'.format(
+            lines.append(STORIES_ROW(
                 '#{}'.format(story.story_id),
                 initials(story.owned_by),
                 story.story_type,
@@ -169,56 +309,62 @@ def show_stories(stories, arguments):
     return lines
 
 
-def show_story(story_id, arguments):
-    """Shows the Details for a single story
+def show_story(story_ids, arguments, index):
+    """Shows the Details for the stories, in the order given
 
-    Will find the associate project,
-    then look up the story and print of the details
+    Every story is shown as soon as it, and the ones before it, arrived
     """
+    style = report_style(arguments)
+    for story_id, story in fetch_stories(story_ids, arguments, index):
+        if story is None:
+            print("hmmm could not find story #{}".format(story_id))
+        else:
+            write_lines(story_lines(story, style))
 
-    story = load_story(story_id, arguments)
 
-    print('')
-    print(colored('{:12s}{:4s}{:9s}{:10s} {}'.format(
+def story_lines(story, style=COLOR):
+    bold = style.bold
+
+    lines = ['']
+    lines.append(bold(STORY_TITLE_ROW(
         '#{}'.format(story.story_id),
         initials(story.owned_by),
         story.story_type,
         estimate_visual(story.estimate),
-        story.name), 'white', attrs=['bold']))
-    print('')
-    print(colored("Story Url: ", 'white', attrs=['bold'])
-          + colored(story.url, 'blue', attrs=['underline']))
-    print(colored("Description: ", 'white', attrs=['bold'])
-          + story.description)
+        story.name)))
+    lines.append('')
+    lines.append(bold("Story Url: ") + style.link(story.url))
+    lines.append(bold("Description: ") + story.description)
 
     if len(story.notes) > 0:
-        print('')
-        print(bold("Notes:"))
+        lines.append('')
+        lines.append(bold("Notes:"))
         for note in story.notes:
-            print("[{}] {}".format(initials(note.author), note.text))
+            lines.append("[{}] {}".format(initials(note.author), note.text))
 
     if len(story.tasks) > 0:
-        print('')
-        print(bold("Tasks:"))
+        lines.append('')
+        lines.append(bold("Tasks:"))
         for task in story.tasks:
-            print("[{}] {}".format(
+            lines.append("[{}] {}".format(
                 x_or_space(task.complete), task.description))
 
     if len(story.attachments) > 0:
-        print('')
-        print(bold("Attachments:"))
+        lines.append('')
+        lines.append(bold("Attachments:"))
         for attachment in story.attachments:
-            print("{} {}".format(
-                attachment.description,
-                colored(attachment.url, 'blue', attrs=['underline'])))
+            lines.append("{} {}".format(
+                attachment.description, style.link(attachment.url)))
 
-    print('')
+    lines.append('')
+    return lines
 
 
-def scrum(project_name, stories, bugs):
+def scrum(project_name, stories, bugs, style=COLOR):
     """ CLI Visual Aid for running the daily SCRUM meeting.
         Prints an list of stories that people are working on grouped by user
     """
+    bold = style.bold
     lines = []
 
     lines.append(bold("{} SCRUM -- {}".format(project_name, pretty_date())))
@@ -231,7 +377,7 @@ def scrum(project_name, stories, bugs):
             name = story.name
             if story.state in ['finished', 'delivered']:
                 name = '{}: {}'.format(bold(story.state), name)
-            lines.append("   #{:12s}{:9s} {:7s} {}".format(
+            lines.append(SCRUM_STORY_ROW(
                 story.story_id,
                 estimate_visual(story.estimate),
                 story.story_type,
@@ -243,30 +389,111 @@ def scrum(project_name, stories, bugs):
     if len(bugs) == 0:
         lines.append('Not sure that I believe it, but there are no bugs')
     for bug in bugs:
-        lines.append("   #{:12s} {:4s} {}".format(bug.story_id,
-                                                  initials(bug.owned_by),
-                                                  bug.name))
+        lines.append(SCRUM_BUG_ROW(bug.story_id, initials(bug.owned_by),
+                                   bug.name))
+    return lines
+
+
+def search_stories(index, arguments):
+    """Lists the stories matching the search terms, best match first"""
+    number_of_stories = 20
+    if arguments['--number'] is not None:
+        number_of_stories = int(arguments['--number'])
+
+    results = index.search(' '.join(arguments['<terms>']), number_of_stories)
+    if len(results) == 0:
+        return ['None']
+
+    return [SEARCH_ROW('#{}'.format(story_id),
+                       initials(doc['owned_by']),
+                       doc['story_type'],
+                       doc['state'],
+                       doc['name'])
+            for score, story_id, doc in results]
+
+
+def show_stats(project_name, project_stats, style=COLOR):
+    """Lists the velocity statistics of a project"""
+    bold = style.bold
+    lines = []
+
+    lines.append(bold("{} STATS".format(project_name)))
+    lines.append('')
+    lines.append("Stories: {}   Points: {}".format(
+        project_stats.total, project_stats.points))
+    lines.append("Unestimated features: {} of {} ({:.0%})".format(
+        project_stats.unestimated, project_stats.features,
+        project_stats.unestimated_share))
+    if project_stats.bugs_per_feature is not None:
+        lines.append("Bugs per feature: {:.2f}".format(
+            project_stats.bugs_per_feature))
+
+    def totals(title, named_totals):
+        lines.append('')
+        lines.append(bold(title))
+        if len(named_totals) == 0:
+            lines.append('None')
+        for name, total in named_totals:
+            lines.append(STATS_ROW(name or 'Nobody', total))
+
+    totals('Points by State', project_stats.points_by_state)
+    totals('Points by Owner', project_stats.points_by_owner)
+    totals('Points by Label', project_stats.points_by_label)
+    totals('Estimates', [('{} points'.format(estimate), count) for
+                         estimate, count in project_stats.estimate_distribution])
     return lines
 
 
-def poker(project):
+def listen(index, arguments):
+    """Serves activity web hooks until interrupted, applying them to the
+    stories in the search index"""
+    def on_activity(activity):
+        print(activity.description or activity.event_type)
+
+    server = make_server(index, arguments['--host'], int(arguments['--port']),
+                         on_activity)
+    print("Listening for pivotal activity on http://{}:{}/".format(
+        arguments['--host'], arguments['--port']))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def poker(project, journal=None):
     """CLI driven tool to help facilitate the periodic poker planning session
 
     Will loop through and display unestimated stories, and prompt the team for an estimate.
     You can also open the current story in a browser for additional editing
+
+    The stories (with their notes, tasks and attachments) are fetched once up
+    front, and estimates are saved in the background, so the team never
+    waits on pivotal between stories.  With a journal, the estimates are
+    recorded in it instead, to be sent with `flush`
     """
-    total_stories = len(project.unestimated_stories())
-    for idx, story in enumerate(project.unestimated_stories()):
-        clear()
-        rows, cols = _get_column_dimensions()
-        print("{} PLANNING POKER SESSION [{}]".format(
-            project.name.upper(),
-            bold("{}/{} Stories Estimated".format(idx + 1, total_stories))))
-        print("-" * cols)
-        pretty_print_story(story)
-        prompt_estimation(project, story)
-    else:
-        print("KaBoom!!! Nice Work Team")
+    stories = project.unestimated_stories()
+    estimates = WriteBehindQueue()
+    try:
+        for idx, story in enumerate(stories):
+            rows, cols = terminal_size()
+            lines = ["{} PLANNING POKER SESSION [{}]{}".format(
+                project.name.upper(),
+                bold("{}/{} Stories Estimated".format(idx + 1, len(stories))),
+                estimates_status(estimates))]
+            lines.append("-" * cols)
+            lines.extend(story_details(story))
+            write_lines(lines, clear=True)
+            prompt_estimation(project, story, estimates, journal)
+        else:
+            print("KaBoom!!! Nice Work Team")
+    finally:
+        if estimates.pending > 0:
+            print("Saving {} estimates...".format(estimates.pending))
+        estimates.join()
+        for description, error in estimates.failed:
+            print("Could not save {}: {}".format(description, error))
 
 
 def load_story(story_id, arguments):
@@ -280,6 +507,131 @@ def load_story(story_id, arguments):
     return story
 
 
+def read_story_ids(arguments):
+    """the <story_ids> arguments, or the ids on stdin when there are none
+    (or just -)"""
+    story_ids = arguments['<story_ids>']
+    if len(story_ids) == 0 or story_ids == ['-']:
+        story_ids = sys.stdin.read().split()
+    return [story_id.lstrip('#') for story_id in story_ids]
+
+
+def story_batches(story_ids, arguments, index):
+    """Resolves the projects of the stories together, and returns the
+    (project, story ids) to fetch with one request each.  The projects come
+    from the search index when it has seen the stories, the stories it has not
+    seen are looked for in every project"""
+    unique_ids = []
+    for story_id in story_ids:
+        if story_id not in unique_ids:
+            unique_ids.append(story_id)
+
+    if arguments['--project-index'] is not None:
+        projects = [select_project(arguments)]
+        by_project = {projects[0].project_id: unique_ids}
+    else:
+        projects = Project.all()
+        by_project = dict((project.project_id, []) for project in projects)
+        unknown = []
+        for story_id in unique_ids:
+            project_id = index.project_for(story_id)
+            if project_id in by_project:
+                by_project[project_id].append(story_id)
+            else:
+                unknown.append(story_id)
+        for ids in by_project.values():
+            ids.extend(unknown)
+
+    batches = []
+    for project in projects:
+        ids = by_project[project.project_id]
+        for start in range(0, len(ids), STORY_BATCH_SIZE):
+            batches.append((project, ids[start:start + STORY_BATCH_SIZE]))
+    return batches
+
+
+def fetch_stories(story_ids, arguments, index):
+    """Fetches the stories with one request per project (and batch), all at
+    once, and yields (story_id, story or None) in the order of story_ids as
+    soon as a story and the ones before it arrived"""
+    def fetch(batch):
+        project, ids = batch
+        return project.get_stories(
+            'id:{} includedone:true'.format(','.join(ids)))
+
+    found = {}
+    position = 0
+    batches = story_batches(story_ids, arguments, index)
+    for (project, ids), stories, error in imap_concurrently(fetch, batches):
+        if error is not None:
+            print("Could not load stories from {}: {}".format(project.name, error))
+        for story in stories or []:
+            found[story.story_id] = story
+        while position < len(story_ids) and story_ids[position] in found:
+            yield story_ids[position], found[story_ids[position]]
+            position += 1
+
+    for story_id in story_ids[position:]:
+        yield story_id, found.get(story_id)
+
+
+def download_story_attachments(arguments):
+    """Downloads the attachments of the given stories, or every story in
+    the project with --all"""
+    if arguments['--all']:
+        project = prompt_project(arguments)
+        stories = project.all_stories(lazy=True)
+    else:
+        stories = load_stories(arguments['<story_ids>'], arguments)
+
+    downloads = download_attachments(stories, arguments['--dest'])
+    failures = 0
+    for story, attachment, path, outcome, error in downloads:
+        if error is not None:
+            failures += 1
+            print("[{}] {} failed: {}".format(story.story_id, path, error))
+        else:
+            print("[{}] {} {}".format(story.story_id, path, outcome))
+    if failures > 0:
+        print("{} downloads failed, run again to resume them".format(failures))
+
+
+def load_stories(story_ids, arguments):
+    """Loads the stories concurrently, yielding them in order"""
+    loads = imap_concurrently(
+        lambda story_id: load_story(story_id, arguments), story_ids)
+    for story_id, story, error in loads:
+        if error is not None:
+            print("Could not load story #{}: {}".format(story_id, error))
+        elif story is None:
+            print("hmmm could not find story #{}".format(story_id))
+        else:
+            yield story
+
+
+def export_stories(project, arguments):
+    path = arguments['--output'] or 'project-{}.jsonl.gz'.format(
+        project.project_id)
+    manifest = export_project(project, path)
+    print("Exported {} stories to {} (sha256 {})".format(
+        manifest['stories'], path, manifest['sha256']))
+
+
+def import_stories(project, arguments):
+    imported = 0
+    failures = 0
+    for record, error in import_archive(project, arguments['<archive>']):
+        if error is not None:
+            failures += 1
+            print("Could not import [{}] {}: {}".format(
+                record['story_id'], record['name'], error))
+        else:
+            imported += 1
+    print("Imported {} stories into {}".format(imported, project.name))
+    if failures > 0:
+        print("{} stories failed, run again to retry them".format(failures))
+
+
 def browser_open(story_id, arguments):
     """Open the given story in a browser"""
 
@@ -303,11 +655,30 @@ def create_story(project, arguments):
 
     stories = {'story': story}
 
-    project.create_story(stories)
+    if project is None:
+        Journal().record_story(stories,
+                               project_index=arguments['--project-index'])
+        print("Story: {} is queued to be created".format(story['name']))
+    else:
+        project.create_story(stories)
+
+
+STATE_CHANGES = [
+    # (command, method, state)
+    ('start', 'start', 'started'),
+    ('finish', 'finish', 'finished'),
+    ('deliver', 'deliver', 'delivered'),
+    ('accept', 'accept', 'accepted'),
+    ('reject', 'reject', 'rejected'),
+]
 
 
 def update_status(arguments):
 
+    if queued(arguments):
+        queue_status(arguments)
+        return
+
     story = None
     if '<story_id>' in arguments:
         story_id = arguments['<story_id>']
@@ -315,27 +686,11 @@ def update_status(arguments):
 
     if story is not None:
         try:
-
-            if arguments['start']:
-                story.start()
-                print("Story: [{}] {} is STARTED".format(
-                    story.story_id, story.name))
-            elif arguments['finish']:
-                story.finish()
-                print("Story: [{}] {} is FINISHED".format(
-                    story.story_id, story.name))
-            elif arguments['deliver']:
-                story.deliver()
-                print("Story: [{}] {} is DELIVERED".format(
-                    story.story_id, story.name))
-            elif arguments['accept']:
-                story.accept()
-                print("Story: [{}] {} is ACCEPTED".format(
-                    story.story_id, story.name))
-            elif arguments['reject']:
-                story.reject()
-                print("Story: [{}] {} is REJECTED".format(
-                    story.story_id, story.name))
+            for command, method, state in STATE_CHANGES:
+                if arguments[command]:
+                    getattr(story, method)()
+                    print("Story: [{}] {} is {}".format(
+                        story.story_id, story.name, state.upper()))
 
         except InvalidStateException as e:
             print(e.message)
@@ -343,17 +698,263 @@ def update_status(arguments):
         print("hmmm could not find story")
 
 
+def queue_status(arguments):
+    """Records a state change in the journal, without touching the network"""
+    story_id = arguments['<story_id>']
+    for command, method, state in STATE_CHANGES:
+        if arguments[command]:
+            Journal().record_state(story_id, state,
+                                   project_index=arguments['--project-index'])
+            print("Story: [{}] is queued to be {}".format(
+                story_id, state.upper()))
+
+
+def flush_journal():
+    """Sends the changes recorded in the journal"""
+    result = flush(Journal())
+
+    if len(result.applied) > 0:
+        print("Sent {} changes".format(len(result.applied)))
+    if len(result.skipped) > 0:
+        print("Skipped {} changes that were already made".format(
+            len(result.skipped)))
+    for entry, conflict in result.conflicts:
+        print("Conflict: {} {} -- {}".format(
+            describe_change(entry), bold(entry['action']), conflict))
+    if len(result.failed) > 0:
+        print("{} changes could not be sent, and are still queued ({})".format(
+            len(result.failed), result.failed[0][1]))
+    if len(result.applied + result.skipped + result.conflicts
+           + result.failed) == 0:
+        print("Nothing to send")
+
+
+def describe_change(entry):
+    if entry['story_id'] is not None:
+        return 'Story: [{}] {}'.format(entry['story_id'], entry['value'])
+    return 'Story: {}'.format(entry['value']['story']['name'])
+
+
+def bulk_command(arguments):
+    """whether the command goes through every story of a project"""
+    return bool(arguments['stats'] or arguments['export']
+                or arguments.get('--all') or arguments.get('--format'))
+
+
+def queued(arguments):
+    return arguments.get('--queue') or arguments.get('--offline')
+
+
+## Reports
+#
+# Each report is split into the queries it sends for a project and the
+# rendering of their results, so that --all-projects can fetch many projects
+# concurrently and then render them one after the other
+
+
+def changelog_queries(project, arguments):
+    """Returns the changelog sections, and the snapshot of what was seen.
+    The snapshot is only saved once the changelog is rendered, so that
+    prefetching a changelog that is never shown does not save one"""
+    if arguments.get('--since') is not None:
+        return changelog_since(project, arguments)
+
+    results = (project.finished_features(),
+               project.finished_bugs(),
+               project.known_issues())
+    snapshot = Snapshot.from_stories(project.project_id, chain(*results))
+    return results + (snapshot,)
+
+
+def changelog_report(arguments):
+    """Runs the changelog report.  A --since snapshot that is missing or can
+    not be read ends the command with a message"""
+    try:
+        return run_report(arguments, changelog_queries, render_changelog)
+    except SnapshotError as e:
+        print(e)
+        exit()
+
+
+def changelog_since(project, arguments):
+    """Only fetches the stories modified since the --since snapshot, and
+    sorts the ones that changed into the changelog sections"""
+    path = snapshot_path(project.project_id, arguments['--since'])
+    if not os.path.exists(path):
+        raise SnapshotError('No changelog snapshot {} for {}'.format(
+            arguments['--since'], project.name))
+    snapshot = Snapshot.load(path)
+    changed, snapshot = changed_stories(project, snapshot)
+
+    done = ['delivered', 'finished']
+    open_states = ['unscheduled', 'unstarted', 'started', 'rejected']
+    return ([story for story in changed
+             if story.story_type == 'feature' and story.state in done],
+            [story for story in changed
+             if story.story_type == 'bug' and story.state in done],
+            [story for story in changed
+             if story.story_type == 'bug' and story.state in open_states],
+            snapshot)
+
+
+def snapshot_name(arguments):
+    return arguments.get('--snapshot') or 'last'
+
+
+def render_changelog(project, results, arguments):
+    finished_features, finished_bugs, known_issues, snapshot = results
+    snapshot.save(snapshot_path(project.project_id, snapshot_name(arguments)))
+    return generate_changelog(project, finished_features, finished_bugs,
+                              known_issues, style=report_style(arguments))
+
+
+def stories_queries(project, arguments):
+    return (project.open_stories(arguments.get('--for')),)
+
+
+def render_stories(project, results, arguments):
+    lines = show_stories(results[0], arguments)
+    if arguments.get('--all-projects'):
+        lines = [report_style(arguments).bold(project.name)] + lines + ['']
+    return lines
+
+
+def scrum_queries(project, arguments):
+    return (project.in_progress_stories(
+                arguments.get('--show-finished', False),
+                arguments.get('--show-delivered', False)),
+            project.open_bugs())
+
+
+def render_scrum(project, results, arguments):
+    lines = scrum(project.name, *results, style=report_style(arguments))
+    if arguments.get('--all-projects'):
+        lines.append('')
+    return lines
+
+
+def changelog_sections(project, arguments):
+    return [('feature', project.finished_features(lazy=True)),
+            ('bug fixed', project.finished_bugs(lazy=True)),
+            ('known issue', project.known_issues(lazy=True))]
+
+
+def stories_sections(project, arguments):
+    stories = project.open_stories(arguments.get('--for'), lazy=True)
+    if arguments.get('--number') is not None:
+        stories = islice(stories, int(arguments['--number']))
+    return [('open', stories)]
+
+
+def scrum_sections(project, arguments):
+    return [('in progress', project.in_progress_stories(
+                arguments.get('--show-finished', False),
+                arguments.get('--show-delivered', False),
+                lazy=True)),
+            ('bug', project.open_bugs(lazy=True))]
+
+
+def stream_records(arguments, sections):
+    """Streams one record per story in the --format, straight from the
+    responses to stdout.  The stories are never collected into a list"""
+    if arguments['--format'] not in FORMATS:
+        print('Unknown format {}, use one of {}'.format(
+            arguments['--format'], ', '.join(FORMATS)))
+        exit()
+
+    if arguments.get('--all-projects'):
+        projects = Project.all()
+    else:
+        projects = [prompt_project(arguments)]
+
+    records = (story_record(story, project.name, section)
+               for project in projects
+               for section, stories in sections(project, arguments)
+               for story in stories)
+    write_records(records, arguments['--format'])
+
+
+def run_report(arguments, queries, render):
+    """Runs a report for the selected project, or every project if the
+    --all-projects option is passed"""
+    if arguments.get('--all-projects'):
+        return merge_reports(Project.all(), arguments, queries, render)
+
+    prefetch = prefetch_report(arguments, queries)
+    project = prompt_project(arguments)
+
+    results = None
+    if prefetch is not None:
+        results = prefetch.take(project.project_id)
+    if results is None:
+        results = queries(project, arguments)
+    return render(project, results, arguments)
+
+
+def prefetch_report(arguments, queries):
+    """Starts fetching the report for the most recently used project in the
+    background, while the projects are loaded and the user picks one.
+
+    Only one project is prefetched, and if another one is picked the
+    prefetch is cancelled before its next request
+    """
+    project = recent_project()
+    if project is None:
+        return None
+
+    prefetch = Prefetch(project.project_id)
+    return prefetch.start(queries, prefetch.guard(project), arguments)
+
+
+def merge_reports(projects, arguments, queries, render):
+    """Fetches the report queries of all projects in parallel and merges them
+    into one report, grouped by project.
+
+    A project that fails is reported on stderr, and does not stop the others
+    """
+    lines = []
+    failures = 0
+    reports = imap_concurrently(
+        lambda project: queries(project, arguments), projects)
+    for project, results, error in reports:
+        if error is not None:
+            failures += 1
+            sys.stderr.write('Could not fetch {}: {}\n'.format(
+                project.name, error))
+            continue
+        lines.extend(render(project, results, arguments))
+
+    if failures > 0:
+        sys.stderr.write('{} of {} projects failed\n'.format(
+            failures, len(projects)))
+    return lines
+
+
 
 ## Helper Methods
 
 
 
 def bold(string):
-    return colored(string, 'white', attrs=['bold'])
+    return COLOR.bold(string)
+
+
+def report_style(arguments):
+    """Reports for a given --project-index are usually piped, so they are
+    left uncolored"""
+    if arguments.get('--project-index') is not None:
+        return PLAIN
+    return COLOR
 
 
 def prompt_project(arguments):
     """prompts the user for a project, if not passed in as a argument"""
+    project = select_project(arguments)
+    remember_project(project)
+    return project
+
+
+def select_project(arguments):
     projects = Project.all()
 
     # Do not prompt -- and auto select the one project if a account only has one project
@@ -386,6 +987,47 @@ def prompt_project(arguments):
     return project
 
 
+def remember_project(project):
+    """Saves the project as the most recently used one, to prefetch it next
+    time"""
+    data = {'project_id': project.project_id, 'name': project.name,
+            'point_scale': project.point_scale}
+    write_atomically(data_path('recent_project.json'),
+                     json.dumps(data).encode('utf-8'))
+
+
+def recent_project():
+    """the most recently used project, or None"""
+    path = data_path('recent_project.json')
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+        return Project(data['project_id'], data['name'], data['point_scale'])
+    except (ValueError, KeyError):
+        return None
+
+
+def use_cassette(arguments):
+    """Records the requests of the command to a cassette with --record, or
+    answers them from one with --replay.  Returns True when replaying"""
+    if arguments.get('--record') and arguments.get('--replay'):
+        print('Pass either --record or --replay, not both')
+        sys.exit(1)
+
+    if arguments.get('--replay'):
+        latency = float(arguments['--latency'] or 0) / 1000
+        set_transport(ReplayTransport(arguments['--replay'], latency))
+        return True
+
+    if arguments.get('--record'):
+        recording = RecordingTransport(arguments['--record'], get_transport())
+        set_transport(recording)
+        atexit.register(recording.close)
+    return False
+
+
 def check_api_token():
     """Check to see if the API Token is set, else give instructions"""
 
@@ -404,15 +1046,6 @@ def check_api_token():
         exit()
 
 
-def initials(full_name):
-    """Return the initials of a passed in name"""
-
-    if full_name is not None and len(full_name) > 0:
-        return ''.join([s[0] for s in full_name.split(' ')]).upper()
-    else:
-        return ''
-
-
 def estimate_visual(estimate):
     if estimate is not None:
         return '[{:8s}]'.format('*' * estimate)
@@ -449,46 +1082,43 @@ def pretty_date():
     return datetime.now().strftime('%b %d, %Y')
 
 
-def clear():
-    """Clears the terminal buffer"""
-    os.system('cls' if os.name == 'nt' else 'clear')
-
-
-def pretty_print_story(story):
-    print
-    print(bold(story.name))
+def story_details(story):
+    lines = ['']
+    lines.append(bold(story.name))
     if len(story.description) > 0:
-        print('')
-        print(story.description)
-        print('')
+        lines.append('')
+        lines.append(story.description)
+        lines.append('')
 
     if len(story.notes) > 0:
-        print('')
-        print(bold('Notes:'))
+        lines.append('')
+        lines.append(bold('Notes:'))
         for note in story.notes:
-            print("[{}] {}".format(initials(note.author), note.text))
+            lines.append("[{}] {}".format(initials(note.author), note.text))
 
     if len(story.attachments) > 0:
-        print('')
-        print(bold('Attachments:'))
+        lines.append('')
+        lines.append(bold('Attachments:'))
         for attachment in story.attachments:
             if len(attachment.description) > 0:
-                print("Description: {}".format(attachment.description))
-            print("Url: {}".format(colored(attachment.url, 'blue')))
+                lines.append("Description: {}".format(attachment.description))
+            lines.append("Url: {}".format(COLOR.blue(attachment.url)))
 
 
     if len(story.tasks) > 0:
-        print('')
-        print(bold("Tasks:"))
+        lines.append('')
+        lines.append(bold("Tasks:"))
         for task in story.tasks:
-            print("[{}] {}".format(x_or_space(task.complete), task.description))
+            lines.append("[{}] {}".format(x_or_space(task.complete), task.description))
 
     if len(story.labels) > 0:
-        print('')
-        print("{} {}".format(bold('Labels:'), story.labels))
+        lines.append('')
+        lines.append("{} {}".format(bold('Labels:'), story.labels))
+
+    return lines
 
 
-def prompt_estimation(project, story):
+def prompt_estimation(project, story, estimates=None, journal=None):
     print('')
     print(bold("Estimate: [{}, (s)kip, (o)pen, (q)uit]".format(
         ','.join(project.point_scale))))
@@ -499,20 +1129,34 @@ def prompt_estimation(project, story):
         return
     elif input_value in ['o', 'O']:
         webbrowser.open(story.url)
-        prompt_estimation(project, story)
+        prompt_estimation(project, story, estimates, journal)
     elif input_value in ['q','Q']:
         exit()
     elif input_value in project.point_scale:
         value = int(input_value)
-        story.assign_estimate(value)
+        if journal is not None:
+            journal.record_estimate(story.story_id, value,
+                                    project_id=project.project_id)
+        elif estimates is None:
+            story.assign_estimate(value)
+        else:
+            estimates.submit('estimate for #{}'.format(story.story_id),
+                             story.assign_estimate, value)
     else:
         print("Invalid Input, Try again")
-        prompt_estimation(project, story)
+        prompt_estimation(project, story, estimates, journal)
 
 
-def _get_column_dimensions():
-    rows, cols = os.popen('stty size', 'r').read().split()
-    return int(rows), int(cols)
+def estimates_status(estimates):
+    """pending/failed indicator for the estimates still being saved"""
+    status = []
+    if estimates.pending > 0:
+        status.append('{} saving'.format(estimates.pending))
+    if len(estimates.failed) > 0:
+        status.append(COLOR.red('{} failed'.format(len(estimates.failed))))
+    if len(status) == 0:
+        return ''
+    return ' [{}]'.format(', '.join(status))
 
 
 def x_or_space(complete):
@@ -535,46 +1179,83 @@ def main():
     input_encoding = 'utf-8'
     if sys.stdin.encoding is not None:
         input_encoding = sys.stdin.encoding
-    output_encoding = 'utf-8'
-    if sys.stdout.encoding is not None:
-        output_encoding = sys.stdout.encoding
 
     arguments = decode_dict(docopt(__doc__), input_encoding)
-    check_api_token()
+
+    index = SearchIndex()
+    if arguments['search']:
+        write_lines(search_stories(index, arguments))
+        return
+    elif arguments['listen']:
+        listen(index, arguments)
+        return
+    elif arguments['completion']:
+        shell = 'bash' if arguments['bash'] else 'zsh'
+        options = [option.long for option in parse_defaults(__doc__)
+                   if option.long and option.long.strip('-')]
+        sys.stdout.write(completion_script(shell, options))
+        return
+
+    if not use_cassette(arguments):
+        check_api_token()
+    # Index every story this command fetches, even if it exits early.  Bulk
+    # commands go through whole projects, too many stories to index
+    if not bulk_command(arguments):
+        STORY_LISTENERS.append(index.add)
+        atexit.register(index.save)
+    completions = CompletionIndex()
+    STORY_LISTENERS.append(completions.add)
+    PROJECT_LISTENERS.append(completions.set_projects)
+    # Saved at exit as well, for the commands that leave through exit()
+    atexit.register(completions.save)
 
     lines = None
-    if arguments['changelog']:
-        project = prompt_project(arguments)
-        generate_changelog(project)
+    if arguments.get('--format') is not None:
+        if arguments['changelog']:
+            stream_records(arguments, changelog_sections)
+        elif arguments['stories']:
+            stream_records(arguments, stories_sections)
+        elif arguments['scrum']:
+            stream_records(arguments, scrum_sections)
+    elif arguments['changelog']:
+        lines = changelog_report(arguments)
     elif arguments['show'] and arguments['stories']:
-        project = prompt_project(arguments)
-        lines = show_stories(project.open_stories(arguments.get('--for')),
-                             arguments)
+        lines = run_report(arguments, stories_queries, render_stories)
     elif arguments['show'] and arguments['story']:
-        show_story(arguments['<story_id>'], arguments)
+        show_story(read_story_ids(arguments), arguments, index)
     elif arguments['open']:
         browser_open(arguments['<story_id>'], arguments)
     elif arguments['scrum']:
-        project = prompt_project(arguments)
-        lines = scrum(
-            project.name,
-            project.in_progress_stories(
-                arguments.get('--show-finished', False),
-                arguments.get('--show-delivered', False)),
-            project.open_bugs())
+        lines = run_report(arguments, scrum_queries, render_scrum)
     elif arguments['poker'] or arguments['planning']:
         project = prompt_project(arguments)
-        poker(project)
+        poker(project, Journal() if queued(arguments) else None)
     elif arguments['create']:
-        project = prompt_project(arguments)
+        project = None
+        if not queued(arguments):
+            project = prompt_project(arguments)
         create_story(project, arguments)
+    elif arguments['flush']:
+        flush_journal()
+    elif arguments['export']:
+        export_stories(prompt_project(arguments), arguments)
+    elif arguments['import']:
+        import_stories(prompt_project(arguments), arguments)
+    elif arguments['download']:
+        download_story_attachments(arguments)
+    elif arguments['stats']:
+        project = prompt_project(arguments)
+        lines = show_stats(project.name, project_stats(project),
+                           report_style(arguments))
     elif arguments['story']:
         update_status(arguments)
     else:
         print(arguments)
 
+    # Saved in the background while the output is written
+    completions.refresh_in_background()
     if lines is not None:
-        sys.stdout.write('\n'.join(lines + ['']).encode(output_encoding))
+        write_lines(lines)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,249 @@
+# Core Imports
+from __future__ import unicode_literals
+import os
+import threading
+from collections import deque
+
+from pivotal_tools.render import initials
+from pivotal_tools.storage import data_path, locked, write_atomically
+
+# The index is a tab separated file, read straight from the completion
+# scripts (with awk) so that completing never starts python.  One row per:
+#   s  story id, project index, owner initials, name, project id
+#   p  project index, name, project id
+#   o  owner initials, name
+STORY = 's'
+PROJECT = 'p'
+OWNER = 'o'
+COLUMNS = {STORY: 5, PROJECT: 3, OWNER: 2}
+
+# Stories kept in the index, the most recently fetched first
+MAX_STORIES = 500
+
+COMMANDS = ['create', 'start', 'finish', 'deliver', 'accept', 'reject',
+            'flush', 'search', 'listen', 'show', 'open', 'changelog', 'scrum',
+            'planning', 'poker', 'stats', 'export', 'import', 'download',
+            'completion']
+
+# The words that can follow a command
+SUBCOMMANDS = [
+    ('show', 'story stories'),
+    ('start|finish|deliver|accept|reject', 'story'),
+    ('download', 'attachments'),
+    ('create', 'feature bug chore'),
+    ('completion', 'bash zsh'),
+]
+
+BASH_SCRIPT = r'''# pivotal_tools completion for bash.  Load it with
+#   eval "$(pivotal_tools completion bash)"
+_pivotal_tools_index() {
+    awk -F '\t' -v type="$1" '$1 == type { print $2 }' \
+        "${PIVOTAL_TOOLS_HOME:-$HOME/.pivotal_tools}/completion.tsv" 2>/dev/null
+}
+
+_pivotal_tools() {
+    local cur=${COMP_WORDS[COMP_CWORD]} option=${COMP_WORDS[COMP_CWORD-1]}
+    if [ "$cur" = "=" ]; then
+        cur=""
+    elif [ "$option" = "=" ]; then
+        option=${COMP_WORDS[COMP_CWORD-2]}
+    fi
+
+    case "$option" in
+        --project-index)
+            COMPREPLY=( $(compgen -W "$(_pivotal_tools_index p)" -- "$cur") )
+            return ;;
+        --for)
+            COMPREPLY=( $(compgen -W "$(_pivotal_tools_index o)" -- "$cur") )
+            return ;;
+    esac
+
+    case "$cur" in
+        -*)
+            COMPREPLY=( $(compgen -W "__OPTIONS__" -- "$cur") )
+            return ;;
+    esac
+
+    if [ "$COMP_CWORD" -eq 1 ]; then
+        COMPREPLY=( $(compgen -W "__COMMANDS__" -- "$cur") )
+        return
+    fi
+    if [ "$COMP_CWORD" -eq 2 ]; then
+        case "${COMP_WORDS[1]}" in
+__BASH_SUBCOMMANDS__
+        esac
+    fi
+
+    case " ${COMP_WORDS[*]} " in
+        *" story "*|*" open "*|*" attachments "*)
+            COMPREPLY=( $(compgen -W "$(_pivotal_tools_index s)" -- "$cur") ) ;;
+    esac
+}
+complete -F _pivotal_tools pivotal_tools
+'''
+
+ZSH_SCRIPT = r'''# pivotal_tools completion for zsh.  Load it with
+#   eval "$(pivotal_tools completion zsh)"
+_pivotal_tools_index() {
+    awk -F '\t' -v type="$1" -v column="$2" \
+        '$1 == type { gsub(":", "\\:", $2); print $2 ":" $column }' \
+        "${PIVOTAL_TOOLS_HOME:-$HOME/.pivotal_tools}/completion.tsv" 2>/dev/null
+}
+
+_pivotal_tools() {
+    local -a entries
+    local option=$words[CURRENT-1]
+    if [[ $words[CURRENT] == --*=* ]]; then
+        option=${words[CURRENT]%%=*}
+        compset -P '*='
+    fi
+
+    case $option in
+        --project-index)
+            entries=(${(f)"$(_pivotal_tools_index p 3)"})
+            _describe project entries
+            return ;;
+        --for)
+            entries=(${(f)"$(_pivotal_tools_index o 3)"})
+            _describe owner entries
+            return ;;
+    esac
+
+    if [[ $words[CURRENT] == -* ]]; then
+        compadd -- __OPTIONS__
+        return
+    fi
+
+    if (( CURRENT == 2 )); then
+        compadd -- __COMMANDS__
+        return
+    fi
+    if (( CURRENT == 3 )); then
+        case $words[2] in
+__ZSH_SUBCOMMANDS__
+        esac
+    fi
+
+    if (( ${words[(I)story]} || ${words[(I)open]} || ${words[(I)attachments]} )); then
+        entries=(${(f)"$(_pivotal_tools_index s 5)"})
+        _describe story entries
+    fi
+}
+compdef _pivotal_tools pivotal_tools
+'''
+
+SCRIPTS = {'bash': BASH_SCRIPT, 'zsh': ZSH_SCRIPT}
+
+
+def completion_script(shell, options):
+    """the completion script for a shell, completing the given options"""
+    if shell == 'bash':
+        subcommands = '\n'.join(
+            '            {}) COMPREPLY=( $(compgen -W "{}" -- "$cur") ); return ;;'.format(
+                commands, words)
+            for commands, words in SUBCOMMANDS)
+    else:
+        subcommands = '\n'.join(
+            '            {}) compadd -- {}; return ;;'.format(commands, words)
+            for commands, words in SUBCOMMANDS)
+    return (SCRIPTS[shell]
+            .replace('__COMMANDS__', ' '.join(COMMANDS))
+            .replace('__OPTIONS__', ' '.join(options))
+            .replace('__BASH_SUBCOMMANDS__', subcommands)
+            .replace('__ZSH_SUBCOMMANDS__', subcommands))
+
+
+def _field(value):
+    """a value that fits in a column: no tabs or newlines"""
+    return ' '.join('{}'.format(value or '').split())
+
+
+class CompletionIndex(object):
+    """The recent stories, projects and owners, precomputed for completion.
+
+    Stories and projects are collected as they are fetched (from any thread),
+    and merged into the index file by save.  Only the rows of the last
+    MAX_STORIES stories are kept, not the stories themselves
+    """
+
+    def __init__(self, path=None):
+        self.path = path or data_path('completion.tsv')
+        # (story id, owner initials, name, project id), the latest last
+        self._stories = deque(maxlen=MAX_STORIES)
+        self._owners = {}
+        self._projects = None
+        self._lock = threading.Lock()
+
+    def add(self, story):
+        if story.story_id:
+            row = (story.story_id, initials(story.owned_by), _field(story.name),
+                   _field(story.project_id))
+            with self._lock:
+                self._stories.append(row)
+                if story.owned_by:
+                    self._owners[row[1]] = _field(story.owned_by)
+
+    def set_projects(self, projects):
+        with self._lock:
+            self._projects = list(projects)
+
+    def read(self):
+        """the rows of the index file, by type.  Damaged rows are dropped"""
+        rows = {STORY: [], PROJECT: [], OWNER: []}
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    fields = line.decode('utf-8').rstrip('\n').split('\t')
+                    if COLUMNS.get(fields[0]) == len(fields) - 1:
+                        rows[fields[0]].append(fields[1:])
+        return rows
+
+    def save(self):
+        """merges what was fetched into the index file, if anything was.
+        The file is locked, as it is saved both from the background and at
+        exit, and by other commands"""
+        with self._lock:
+            stories, self._stories = self._stories, deque(maxlen=MAX_STORIES)
+            added_owners, self._owners = self._owners, {}
+            projects, self._projects = self._projects, None
+        if len(stories) == 0 and projects is None:
+            return
+
+        with locked(self.path):
+            self._merge(stories, added_owners, projects)
+
+    def _merge(self, stories, added_owners, projects):
+        rows = self.read()
+        if projects is not None:
+            rows[PROJECT] = [['{}'.format(idx + 1), _field(project.name),
+                              project.project_id]
+                             for idx, project in enumerate(projects)]
+        project_indices = dict((project_id, idx)
+                               for idx, name, project_id in rows[PROJECT])
+
+        owners = dict(rows[OWNER])
+        owners.update(added_owners)
+        story_rows = [[story_id, '', owner, name, project_id]
+                      for story_id, owner, name, project_id in reversed(stories)]
+        story_rows.extend(rows[STORY])
+
+        seen = set()
+        lines = []
+        for story_id, _, owner, name, project_id in story_rows:
+            if story_id in seen or len(seen) >= MAX_STORIES:
+                continue
+            seen.add(story_id)
+            lines.append([STORY, story_id, project_indices.get(project_id, ''),
+                          owner, name, project_id])
+        lines.extend([PROJECT] + row for row in rows[PROJECT])
+        lines.extend([OWNER, owner, name] for owner, name in sorted(owners.items()))
+
+        write_atomically(self.path, ''.join(
+            '\t'.join(line) + '\n' for line in lines).encode('utf-8'))
+
+    def refresh_in_background(self):
+        """saves the index from a thread of its own, which the interpreter
+        waits for before it exits"""
+        thread = threading.Thread(target=self.save)
+        thread.start()
+        return thread
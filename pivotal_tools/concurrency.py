@@ -0,0 +1,206 @@
+# Core Imports
+from __future__ import unicode_literals
+import threading
+import time
+from collections import deque
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty  # flake8: noqa
+
+DEFAULT_WORKERS = 8
+
+
+class _Job(object):
+    """a single call waiting to be run by one of the workers"""
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+def _work(func, jobs):
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        try:
+            job.result = func(job.item)
+        except Exception as e:
+            job.error = e
+        job.done.set()
+
+
+def imap_concurrently(func, items, max_workers=DEFAULT_WORKERS):
+    """Calls func for every item from a bounded pool of threads.
+
+    Yields (item, result, error) tuples in input order, as soon as the item and
+    every item before it has completed.  An exception raised by func is
+    returned as the error instead of aborting the other calls.  At most
+    max_workers items are read ahead, so items can be a lazy iterator.
+    """
+    jobs = Queue()
+    workers = []
+    pending = deque()
+
+    def finish(job):
+        job.done.wait()
+        return job.item, job.result, job.error
+
+    try:
+        for item in items:
+            job = _Job(item)
+            pending.append(job)
+            jobs.put(job)
+            if len(workers) < max_workers:
+                worker = threading.Thread(target=_work, args=(func, jobs))
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+
+            if len(pending) >= max_workers:
+                yield finish(pending.popleft())
+
+        while pending:
+            yield finish(pending.popleft())
+    finally:
+        # Drop anything that has not started yet if we were closed early
+        while True:
+            try:
+                jobs.get_nowait()
+            except Empty:
+                break
+        for _ in workers:
+            jobs.put(None)
+
+
+def map_concurrently(func, items, max_workers=DEFAULT_WORKERS):
+    """Like imap_concurrently, but returns a list"""
+    return list(imap_concurrently(func, items, max_workers))
+
+
+class WriteBehindQueue(object):
+    """Runs calls in the background on a bounded pool of threads, so the caller
+    never waits on the network.
+
+    Failed calls are retried with a growing delay, and given up on after
+    `retries` attempts.  Calls that were given up on are kept in `failed`
+    as (description, error) tuples.
+    """
+
+    def __init__(self, max_workers=4, retries=3, retry_delay=1.0):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.failed = []
+        self._calls = Queue()
+        self._workers = []
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """number of calls submitted, but not completed or given up on yet"""
+        with self._lock:
+            return self._pending
+
+    def submit(self, description, func, *args):
+        with self._lock:
+            self._pending += 1
+        self._calls.put((description, func, args))
+        if len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def join(self):
+        """blocks until every submitted call has completed or been given up on"""
+        self._calls.join()
+
+    def _work(self):
+        while True:
+            description, func, args = self._calls.get()
+            for attempt in range(1, self.retries + 1):
+                try:
+                    func(*args)
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        with self._lock:
+                            self.failed.append((description, e))
+                    else:
+                        time.sleep(self.retry_delay * attempt)
+            with self._lock:
+                self._pending -= 1
+            self._calls.task_done()
+
+
+class Cancelled(Exception):
+    """raised in a Prefetch that was cancelled, to stop it early"""
+
+
+class Prefetch(object):
+    """Speculatively runs a call on a background thread, for a result that
+    may or may not be wanted later, as the result for `key`.
+
+    Cancelling it stops it before its next call through `guard`, so an
+    unwanted prefetch gives up as soon as its current request is done.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self._result = None
+        self._error = None
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+
+    def start(self, func, *args):
+        thread = threading.Thread(target=self._run, args=(func, args))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def _run(self, func, args):
+        try:
+            self._result = func(*args)
+        except Exception as e:
+            self._error = e
+        self._done.set()
+
+    def guard(self, target):
+        """wraps target, so that every method call on it raises Cancelled
+        once the prefetch is cancelled"""
+        return _Guarded(target, self._cancelled)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def take(self, key):
+        """Waits for and returns the result if it was prefetched for key.
+        Otherwise (or if the prefetch failed) cancels it and returns None"""
+        if key != self.key:
+            self.cancel()
+            return None
+        self._done.wait()
+        if self._error is not None:
+            return None
+        return self._result
+
+
+class _Guarded(object):
+    def __init__(self, target, cancelled):
+        self._target = target
+        self._cancelled = cancelled
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            if self._cancelled.is_set():
+                raise Cancelled()
+            return attribute(*args, **kwargs)
+        return call
@@ -0,0 +1,131 @@
+# Core Imports
+from __future__ import unicode_literals
+import json
+import os
+import re
+try:
+    from urllib.parse import urlparse, unquote
+except ImportError:
+    from urlparse import urlparse  # flake8: noqa
+    from urllib import unquote  # flake8: noqa
+
+from pivotal_tools.concurrency import imap_concurrently
+from pivotal_tools.storage import write_atomically
+
+CHUNK_SIZE = 64 * 1024
+
+# Downloads running at the same time
+MAX_DOWNLOADS = 4
+
+DOWNLOADED = 'downloaded'
+RESUMED = 'resumed'
+UNCHANGED = 'unchanged'
+
+
+def attachment_path(directory, story, attachment):
+    """<directory>/<story_id>/<attachment_id>-<file name from the url>"""
+    name = os.path.basename(unquote(urlparse(attachment.url).path)) or 'attachment'
+    name = re.sub(r'[^\w.-]', '_', name, flags=re.UNICODE)
+    return os.path.join(directory, story.story_id,
+                        '{}-{}'.format(attachment.attachment_id, name))
+
+
+def download_attachment(attachment, path):
+    """Streams an attachment body to path, in chunks.
+
+    A .part file left by an interrupted download is resumed with a Range
+    request, if it was started from the version of the attachment that is
+    there now (its ETag is saved in a .part.meta file).  When a file was
+    downloaded before and its ETag (or, without one, its size) is unchanged,
+    nothing is downloaded.  Returns DOWNLOADED, RESUMED or UNCHANGED
+    """
+    meta_path = path + '.meta'
+    part_path = path + '.part'
+    part_meta_path = part_path + '.meta'
+
+    head = attachment.head()
+    etag = head.headers.get('ETag')
+    size = head.headers.get('Content-Length')
+
+    if os.path.exists(path) and os.path.exists(meta_path):
+        meta = _read_meta(meta_path)
+        if etag is not None and meta.get('etag') == etag:
+            return UNCHANGED
+        if (etag is None and size is not None
+                and size == str(os.path.getsize(path))):
+            return UNCHANGED
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Made by another download meanwhile
+            if not os.path.isdir(directory):
+                raise
+
+    # The .part file is only resumed if it holds the version of the
+    # attachment that is there now.  Without an ETag there is no telling,
+    # so it is downloaded again
+    offset = 0
+    if (etag is not None and os.path.exists(part_path)
+            and os.path.exists(part_meta_path)
+            and _read_meta(part_meta_path).get('etag') == etag):
+        offset = os.path.getsize(part_path)
+
+    response = attachment.open(offset, etag)
+    try:
+        if response.status_code == 206:
+            mode = 'ab'
+        elif response.status_code == 416:
+            # The part file already holds the whole body
+            mode = None
+        else:
+            offset = 0
+            mode = 'wb'
+            etag = response.headers.get('ETag', etag)
+            write_atomically(part_meta_path, json.dumps(
+                {'url': attachment.url, 'etag': etag}).encode('utf-8'))
+
+        if mode is not None:
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+    finally:
+        response.close()
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(part_path, path)
+    os.remove(part_meta_path)
+    meta = {'url': attachment.url, 'etag': etag,
+            'size': os.path.getsize(path)}
+    write_atomically(meta_path, json.dumps(meta).encode('utf-8'))
+
+    if offset > 0:
+        return RESUMED
+    return DOWNLOADED
+
+
+def _read_meta(path):
+    with open(path, 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def download_attachments(stories, directory, max_downloads=MAX_DOWNLOADS):
+    """Downloads the attachments of the stories, max_downloads at a time.
+
+    stories can be a lazy iterator.  Yields (story, attachment, path, outcome,
+    error) for each attachment, as the downloads complete
+    """
+    jobs = ((story, attachment, attachment_path(directory, story, attachment))
+            for story in stories
+            for attachment in story.attachments)
+
+    def download(job):
+        story, attachment, path = job
+        return download_attachment(attachment, path)
+
+    for job, outcome, error in imap_concurrently(download, jobs, max_downloads):
+        story, attachment, path = job
+        yield story, attachment, path, outcome, error
@@ -0,0 +1,92 @@
+# Core Imports
+from __future__ import unicode_literals
+import csv
+import io
+import json
+import sys
+
+FORMATS = ['jsonl', 'csv', 'tsv']
+
+FIELDS = ['project', 'section', 'story_id', 'story_type', 'state',
+          'estimate', 'owned_by', 'labels', 'name', 'url']
+
+# Records are written (and flushed) in chunks of this many
+CHUNK_SIZE = 100
+
+PY2 = sys.version_info[0] == 2
+
+
+def story_record(story, project_name=None, section=None):
+    """the machine readable record of a story, with FIELDS as keys"""
+    return {
+        'project': project_name,
+        'section': section,
+        'story_id': story.story_id,
+        'story_type': story.story_type,
+        'state': story.state,
+        'estimate': story.estimate,
+        'owned_by': story.owned_by,
+        'labels': story.labels,
+        'name': story.name,
+        'url': story.url,
+    }
+
+
+def write_records(records, output_format, stream=None, chunk_size=CHUNK_SIZE):
+    """Writes records to the stream as they come, one per line, in chunks.
+
+    records can be a lazy iterator; only one chunk is held in memory at a time
+    """
+    stream = stream or sys.stdout
+    encode = _encoder(output_format)
+    out = getattr(stream, 'buffer', stream)
+    stream.flush()
+
+    chunk = []
+    if output_format != 'jsonl':
+        chunk.append(encode(FIELDS))
+    for record in records:
+        chunk.append(encode(record))
+        if len(chunk) >= chunk_size:
+            _write_chunk(out, chunk)
+            chunk = []
+    _write_chunk(out, chunk)
+
+
+def _write_chunk(out, chunk):
+    if len(chunk) > 0:
+        out.write(b''.join(chunk))
+        out.flush()
+
+
+def _encoder(output_format):
+    """returns a function encoding one record (or the header row) as a line
+    of utf-8 bytes"""
+    if output_format == 'jsonl':
+        def encode(record):
+            return (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+        return encode
+
+    if output_format not in FORMATS:
+        raise ValueError('Unknown format {}, use one of {}'.format(
+            output_format, ', '.join(FORMATS)))
+
+    delimiter = str('\t' if output_format == 'tsv' else ',')
+
+    def encode(record):
+        if isinstance(record, dict):
+            values = [record[field] for field in FIELDS]
+        else:
+            values = record
+        values = ['' if value is None else value for value in values]
+
+        if PY2:
+            line = io.BytesIO()
+            csv.writer(line, delimiter=delimiter, lineterminator=str('\n')).writerow(
+                [('{}'.format(value)).encode('utf-8') for value in values])
+            return line.getvalue()
+
+        line = io.StringIO()
+        csv.writer(line, delimiter=delimiter, lineterminator='\n').writerow(values)
+        return line.getvalue().encode('utf-8')
+    return encode
@@ -0,0 +1,289 @@
+# Core Imports
+from __future__ import unicode_literals
+import json
+import os
+import time
+import uuid
+
+# 3rd Party Imports
+import requests
+
+from pivotal_tools.pivotal import Project, find_project_for_story
+from pivotal_tools.concurrency import map_concurrently
+from pivotal_tools.storage import data_path, locked, write_atomically
+
+SET_STATE = 'set_state'
+ASSIGN_ESTIMATE = 'assign_estimate'
+CREATE_STORY = 'create_story'
+
+# States a story can only move to once it has been estimated
+ESTIMATED_STATES = ['started', 'finished', 'delivered']
+
+# Responses meaning the change no longer fits the story.  Any other error
+# (an expired token, a rate limit) leaves the change queued to be retried
+CONFLICT_STATUSES = (409, 422)
+
+
+class Conflict(Exception):
+    """a journal entry that can not be applied to the story as it is now"""
+
+
+class Unresolved(Exception):
+    """a journal entry whose project can not be found.  It is kept queued, as
+    it holds a change that would otherwise be lost"""
+
+
+class Journal(object):
+    """Append-only local journal of changes to send to pivotal later.
+
+    Recording a change only appends a line to a file, so it is instant and
+    works without a network.  `flush` replays the changes in order.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or data_path('journal.jsonl')
+
+    def _locked(self):
+        """holds a lock on the journal against other processes, so that a
+        change recorded while another one removes entries is never lost"""
+        return locked(self.path)
+
+    def record(self, action, project_id=None, project_index=None, **fields):
+        """appends a change to the journal, and returns it"""
+        entry = dict(fields)
+        entry['id'] = uuid.uuid4().hex
+        entry['action'] = action
+        entry['project_id'] = project_id
+        entry['project_index'] = project_index
+        entry['recorded_at'] = time.time()
+
+        line = json.dumps(entry, sort_keys=True) + '\n'
+        with self._locked():
+            with open(self.path, 'ab') as f:
+                f.write(line.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+        return entry
+
+    def record_state(self, story_id, state, **project):
+        return self.record(SET_STATE, story_id=story_id, value=state, **project)
+
+    def record_estimate(self, story_id, estimate, **project):
+        return self.record(ASSIGN_ESTIMATE, story_id=story_id, value=estimate,
+                           **project)
+
+    def record_story(self, story_dict, **project):
+        return self.record(CREATE_STORY, story_id=None, value=story_dict,
+                           **project)
+
+    def entries(self):
+        """returns the recorded changes, oldest first"""
+        if not os.path.exists(self.path):
+            return []
+
+        entries = []
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    # A write that was cut short, nothing was acknowledged
+                    continue
+        return entries
+
+    def remove(self, entry_ids):
+        """removes the given changes.  Changes recorded by other processes
+        wait for the journal to be rewritten, so none are lost"""
+        entry_ids = set(entry_ids)
+        with self._locked():
+            remaining = [entry for entry in self.entries()
+                         if entry['id'] not in entry_ids]
+            data = ''.join(json.dumps(entry, sort_keys=True) + '\n'
+                           for entry in remaining)
+            write_atomically(self.path, data.encode('utf-8'))
+
+
+class FlushResult(object):
+    def __init__(self):
+        self.applied = []
+        self.skipped = []
+        self.conflicts = []
+        self.failed = []
+
+
+def dedupe(entries):
+    """Splits entries into the ones to replay, and the ones that are
+    redundant: a state change identical to the previous one for the story,
+    or an estimate that is overwritten by the story's next estimate before any
+    state change of the story (which may depend on the estimate)"""
+    duplicates = []
+    last_state = {}
+    # story id -> its estimate with no state change after it yet
+    open_estimate = {}
+    for entry in entries:
+        story_id = entry['story_id']
+        if entry['action'] == SET_STATE:
+            open_estimate.pop(story_id, None)
+            if last_state.get(story_id) == entry['value']:
+                duplicates.append(entry)
+            last_state[story_id] = entry['value']
+        elif entry['action'] == ASSIGN_ESTIMATE:
+            if story_id in open_estimate:
+                duplicates.append(open_estimate[story_id])
+            open_estimate[story_id] = entry
+
+    duplicate_ids = set(entry['id'] for entry in duplicates)
+    unique = [entry for entry in entries if entry['id'] not in duplicate_ids]
+    return unique, duplicates
+
+
+def flush(journal, batch_size=50):
+    """Replays the journal against pivotal in batches.
+
+    Within a batch, the changes for each project are replayed in order and the
+    projects are replayed concurrently.  After every batch the sent changes
+    (and conflicts, which are reported instead) are removed from the
+    journal, so an interrupted flush picks up where it left off.  Changes that
+    fail to send, or whose project can not be found, stay in the journal.
+    """
+    result = FlushResult()
+    entries, duplicates = dedupe(journal.entries())
+    result.skipped.extend(duplicates)
+    journal.remove([entry['id'] for entry in duplicates])
+    if len(entries) == 0:
+        return result
+
+    resolver = _ProjectResolver(Project.all())
+    # Projects with a change that failed to send: their later changes are held
+    # back, so that they are never applied out of order
+    blocked = {}
+    for start in range(0, len(entries), batch_size):
+        batch = entries[start:start + batch_size]
+        by_project = {}
+        order = []
+        for entry in batch:
+            try:
+                project = resolver.resolve(entry)
+            except Conflict as e:
+                result.conflicts.append((entry, e))
+                continue
+            except Unresolved as e:
+                result.failed.append((entry, e))
+                continue
+            if project.project_id in blocked:
+                result.failed.append((entry, blocked[project.project_id]))
+                continue
+            if project.project_id not in by_project:
+                order.append(project)
+                by_project[project.project_id] = []
+            by_project[project.project_id].append(entry)
+
+        replays = map_concurrently(
+            lambda project: _replay(project, by_project[project.project_id]),
+            order)
+        for project, project_result, error in replays:
+            for outcome, entry, detail in project_result:
+                if outcome == 'applied':
+                    result.applied.append(entry)
+                elif outcome == 'skipped':
+                    result.skipped.append(entry)
+                elif outcome == 'conflict':
+                    result.conflicts.append((entry, detail))
+                else:
+                    result.failed.append((entry, detail))
+                    blocked[project.project_id] = detail
+
+        done = [entry['id'] for entry in result.applied + result.skipped]
+        done += [entry['id'] for entry, _ in result.conflicts]
+        journal.remove(done)
+
+    return result
+
+
+class _ProjectResolver(object):
+    """finds the project of journal entries, remembering what it found"""
+
+    def __init__(self, projects):
+        self.projects = projects
+        self.by_story = {}
+
+    def resolve(self, entry):
+        if entry['project_id'] is not None:
+            for project in self.projects:
+                if project.project_id == entry['project_id']:
+                    return project
+            raise Unresolved('no project {}'.format(entry['project_id']))
+
+        if entry['project_index'] is not None:
+            try:
+                return self.projects[int(entry['project_index']) - 1]
+            except (IndexError, ValueError):
+                raise Unresolved('no project at index {}'.format(
+                    entry['project_index']))
+
+        if entry['story_id'] is None:
+            if len(self.projects) == 1:
+                return self.projects[0]
+            raise Unresolved('no project given, and you have several')
+
+        story_id = entry['story_id']
+        if story_id not in self.by_story:
+            self.by_story[story_id] = find_project_for_story(story_id)
+        if self.by_story[story_id] is None:
+            raise Conflict('story not found')
+        return self.by_story[story_id]
+
+
+def _replay(project, entries):
+    """Applies entries to a project in order.  Returns (outcome, entry, detail)
+    tuples, where outcome is one of applied, skipped, conflict or failed"""
+    outcomes = []
+    for idx, entry in enumerate(entries):
+        try:
+            if _apply(project, entry):
+                outcomes.append(('applied', entry, None))
+            else:
+                outcomes.append(('skipped', entry, None))
+        except Conflict as e:
+            outcomes.append(('conflict', entry, e))
+        except requests.HTTPError as e:
+            if (e.response is not None
+                    and e.response.status_code in CONFLICT_STATUSES):
+                outcomes.append(('conflict', entry, Conflict(str(e))))
+            else:
+                outcomes.extend(('failed', held, e) for held in entries[idx:])
+                break
+        except Exception as e:
+            outcomes.extend(('failed', held, e) for held in entries[idx:])
+            break
+    return outcomes
+
+
+def _apply(project, entry):
+    """Sends one change.  Returns False if the story already had it"""
+    if entry['action'] == CREATE_STORY:
+        project.create_story(entry['value'])
+        return True
+
+    story = project.load_story(entry['story_id'])
+    if story is None:
+        raise Conflict('story not found')
+
+    if entry['action'] == SET_STATE:
+        state = entry['value']
+        if story.state == state:
+            return False
+        if story.state == 'accepted':
+            raise Conflict('story was already accepted')
+        if state in ESTIMATED_STATES and story.estimate == -1:
+            raise Conflict('Story must be estimated')
+        story.set_state(state)
+        return True
+
+    if entry['action'] == ASSIGN_ESTIMATE:
+        if story.estimate == entry['value']:
+            return False
+        story.assign_estimate(entry['value'])
+        return True
+
+    raise Conflict('unknown change {}'.format(entry['action']))
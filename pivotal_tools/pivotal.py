@@ -2,17 +2,48 @@
 from __future__ import unicode_literals
 import os
 try:
-    from urllib.parse import quote as quote
+    from urllib.parse import quote as quote, urljoin
 except ImportError:
     from urllib import quote  # flake8: noqa
+    from urlparse import urljoin  # flake8: noqa
 import xml.etree.ElementTree as ET
 
 # 3rd Party Imports
 import requests
 import dicttoxml
 
+from pivotal_tools import v5
+from pivotal_tools.transport import HttpTransport
+
 TOKEN = os.getenv('PIVOTAL_TOKEN', None)
 
+# Redirects followed for an attachment body at most
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# The API to talk to: 3 (XML, every field of every story) or 5 (JSON, only the
+# fields each command needs).  Picks the backend every request goes through
+API_VERSION = os.getenv('PIVOTAL_API_VERSION', '3')
+
+# How much of a story to fetch: what the reports show, or everything
+SUMMARY = 'summary'
+DETAILS = 'details'
+
+# Called with every story parsed from pivotal (possibly from several threads),
+# to keep local indexes of the stories up to date
+STORY_LISTENERS = []
+
+# Called with the list of projects every time it is fetched
+PROJECT_LISTENERS = []
+
+# One pooled session shared by every request (and thread), so concurrent
+# fetches reuse connections instead of opening a new one per request
+_session = requests.Session()
+
+# Sends every request.  Replaced by a RecordingTransport or a ReplayTransport
+# to record the session to a cassette, or to play one back
+_transport = HttpTransport(_session)
+
 
 def find_project_for_story(story_id):
     """If we have multiple projects, will loop through the projects to find the one with the given story.
@@ -29,6 +60,15 @@ def find_project_for_story(story_id):
     return None
 
 
+def get_transport():
+    return _transport
+
+
+def set_transport(transport):
+    global _transport
+    _transport = transport
+
+
 def get_project_by_index(index):
     return Project.all()[index]
 
@@ -56,6 +96,24 @@ class Attachment(object):
         self.description = description
         self.url = url
 
+    def head(self):
+        """returns the response to a HEAD request for the attachment body"""
+        return _perform_pivotal_head(self.url)
+
+    def open(self, offset=0, etag=None):
+        """returns a streaming response for the attachment body, from offset.
+        If the body no longer matches etag, the whole body is sent instead"""
+        headers = {}
+        if offset > 0:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            if etag:
+                headers['If-Range'] = etag
+        response = _perform_attachment_request('GET', self.url, headers,
+                                               stream=True)
+        if response.status_code != 416:
+            response.raise_for_status()
+        return response
+
 
 class Story(object):
     """object representation of a Pivotal story"""
@@ -73,6 +131,8 @@ class Story(object):
         self.notes = []
         self.attachments = []
         self.tasks = []
+        # Only the SUMMARY fields were fetched (v5)
+        self.summary = False
 
 
     @property
@@ -137,20 +197,54 @@ class Story(object):
                 complete = _parse_boolean(task_node, 'complete')
                 story.tasks.append(Task(task_id, description, complete))
 
+        return _parsed(story)
 
+    @classmethod
+    def from_json(cls, data, summary=False):
+        """instantiates a Story object from a v5 story, holding the fields it
+        was fetched with"""
 
-        return story
+        story = Story()
+        story.summary = summary
+        story.story_id = '{}'.format(data['id'])
+        story.name = data.get('name', '')
+        owners = data.get('owners') or [{}]
+        story.owned_by = owners[0].get('name', '')
+        story.story_type = data.get('story_type', '')
+        story.state = data.get('current_state', '')
+        story.description = data.get('description', '')
+        story.estimate = data.get('estimate')
+        if story.estimate is None and story.story_type == 'feature':
+            # v3 reports unestimated features as -1
+            story.estimate = -1
+        story.labels = ','.join(label['name'] for label in data.get('labels', []))
+        story.url = data.get('url', '')
+        story.project_id = '{}'.format(data.get('project_id', ''))
+
+        for comment in data.get('comments', []):
+            author = (comment.get('person') or {}).get('name', '')
+            if comment.get('text'):
+                story.notes.append(Note('{}'.format(comment['id']),
+                                        comment['text'], author))
+            for attachment in comment.get('file_attachments', []):
+                story.attachments.append(Attachment(
+                    '{}'.format(attachment['id']), attachment.get('filename', ''),
+                    v5.FILES_URL + attachment.get('download_url', '')))
+
+        for task in data.get('tasks', []):
+            story.tasks.append(Task('{}'.format(task['id']),
+                                    task.get('description', ''),
+                                    task.get('complete', False)))
+
+        return _parsed(story)
 
     def assign_estimate(self, estimate):
         """changes the estimate of a story"""
-        update_story_url ="https://www.pivotaltracker.com/services/v3/projects/{}/stories/{}?story[estimate]={}".format(self.project_id, self.story_id, estimate)
-        response = _perform_pivotal_put(update_story_url)
+        return _backend.update_story(self, {'estimate': int(estimate)})
 
     def set_state(self, state):
         """changes the estimate of a story"""
-        update_story_url ="https://www.pivotaltracker.com/services/v3/projects/{}/stories/{}?story[current_state]={}".format(self.project_id, self.story_id, state)
-        response = _perform_pivotal_put(update_story_url)
-        return response
+        return _backend.update_story(self, {'current_state': state})
 
     def finish(self):
         if self.estimate == -1:
@@ -174,6 +268,52 @@ class Story(object):
         self.set_state('rejected')
 
 
+class Activity(object):
+    """object representation of a Pivotal activity, as posted by activity web hooks"""
+
+    # Story fields sent in activities, and the Story attributes they change
+    STORY_FIELDS = [
+        ('name', 'name'),
+        ('current_state', 'state'),
+        ('story_type', 'story_type'),
+        ('owned_by', 'owned_by'),
+        ('labels', 'labels'),
+    ]
+
+    def __init__(self, event_type, project_id, description):
+        self.event_type = event_type
+        self.project_id = project_id
+        self.description = description
+        # (story_id, {attribute: new value}, new text such as notes)
+        self.stories = []
+
+    @classmethod
+    def from_node(cls, node):
+        """instantiates an Activity from an elementTree node.  Activities only
+        carry the story fields that changed"""
+        activity = Activity(_parse_text(node, 'event_type'),
+                            _parse_text(node, 'project_id') or None,
+                            _parse_text(node, 'description'))
+
+        story_nodes = node.find('stories')
+        if story_nodes is not None:
+            for story_node in story_nodes:
+                changes = {}
+                for field, attribute in cls.STORY_FIELDS:
+                    if story_node.find(field) is not None:
+                        changes[attribute] = _parse_text(story_node, field)
+
+                text = [_parse_text(story_node, 'description')]
+                note_nodes = story_node.find('notes')
+                if note_nodes is not None:
+                    text.extend(_parse_text(note_node, 'text')
+                                for note_node in note_nodes)
+                activity.stories.append((_parse_text(story_node, 'id'),
+                                         changes,
+                                         ' '.join(t for t in text if t)))
+        return activity
+
+
 class InvalidStateException(Exception): pass
 
 class Project(object):
@@ -191,15 +331,16 @@ class Project(object):
         point_scale = _parse_array(project_node, 'point_scale')
         return Project(id, name, point_scale)
 
+    @classmethod
+    def from_json(cls, data):
+        point_scale = data.get('point_scale')
+        return Project('{}'.format(data['id']), data.get('name', ''),
+                       point_scale.split(',') if point_scale else None)
+
     @classmethod
     def all(cls):
         """returns all projects for the given user"""
-        projects_url = 'https://www.pivotaltracker.com/services/v3/projects'
-        response = _perform_pivotal_get(projects_url)
-
-        root = ET.fromstring(response.content)
-        if root is not None:
-            return [Project.from_node(project_node) for project_node in root]
+        return _listed(_backend.all_projects())
 
     @classmethod
     def load_project(cls, project_id):
@@ -210,87 +351,245 @@ class Project(object):
         name = _parse_text(project_node, 'name')
         return Project(project_id, name)
 
-    def get_stories(self, filter_string):
+    def get_stories(self, filter_string, fields=DETAILS):
         """Given a filter strong, returns an list of stories matching that filter.  If none will return an empty list
         Look at [link](https://www.pivotaltracker.com/help/faq#howcanasearchberefined) for syntax
 
+        With v5, fields (SUMMARY or DETAILS) is how much of the stories to fetch
         """
-        story_filter = quote(filter_string.encode('utf-8'), safe=b'')
-        stories_url = "https://www.pivotaltracker.com/services/v3/projects/{}/stories?filter={}".format(self.project_id, story_filter)
-        response = _perform_pivotal_get(stories_url)
-        stories_root = ET.fromstring(response.content)
+        return _backend.get_stories(self, filter_string, fields)
 
-        return [Story.from_node(story_node) for story_node in stories_root]
+    def iter_stories(self, filter_string, fields=DETAILS):
+        """Like get_stories, but yields the stories one at a time while the
+        response is still streaming in, without holding all of them in memory
+        """
+        return _backend.iter_stories(self, filter_string, fields)
+
+    def _stories(self, filter_string, lazy, fields):
+        if lazy:
+            return self.iter_stories(filter_string, fields)
+        return self.get_stories(filter_string, fields)
 
     def load_story(self, story_id):
         """Trys to find a story, returns None is not found"""
-        story_url = "https://www.pivotaltracker.com/services/v3/projects/{}/stories/{}".format(self.project_id, story_id)
-
-        response = _perform_pivotal_get(story_url)
-        # print(response.content)
-        if response.status_code == 404:
-            # Not Found
-            return None
-        else:
-            #Found, parsing story
-            root = ET.fromstring(response.content)
-            return Story.from_node(root)
+        return _backend.load_story(self, story_id)
 
     def create_story(self,story_dict):
-        stories_url = "https://www.pivotaltracker.com/services/v3/projects/{}/stories".format(self.project_id)
-        story_xml = dicttoxml.dicttoxml(story_dict, root=False)
-        _perform_pivotal_post(stories_url, story_xml)
+        _backend.create_story(self, story_dict)
 
     def unestimated_stories(self):
         stories = self.get_stories('type:feature state:unstarted')
-        return self.open_bugs() + [story for story in stories if int(story.estimate) == -1]
+        return self.open_bugs(fields=DETAILS) + [story for story in stories if int(story.estimate) == -1]
 
-    def open_bugs(self):
-        return self.get_stories('type:bug state:unstarted')
+    def open_bugs(self, lazy=False, fields=SUMMARY):
+        return self._stories('type:bug state:unstarted', lazy, fields)
 
     def in_progress_stories(self, finished_is_in_progress=False,
-                            delivered_is_in_progress=False):
+                            delivered_is_in_progress=False, lazy=False,
+                            fields=SUMMARY):
         _filter = 'state:started,rejected'
         if finished_is_in_progress:
             _filter += ',finished'
         if finished_is_in_progress:
             _filter += ',delivered'
-        return self.get_stories(_filter)
+        return self._stories(_filter, lazy, fields)
 
-    def finished_features(self):
-        return self.get_stories('state:delivered,finished type:feature')
+    def finished_features(self, lazy=False, fields=SUMMARY):
+        return self._stories('state:delivered,finished type:feature', lazy, fields)
 
-    def finished_bugs(self):
-        return self.get_stories('state:delivered,finished type:bug')
+    def finished_bugs(self, lazy=False, fields=SUMMARY):
+        return self._stories('state:delivered,finished type:bug', lazy, fields)
 
-    def known_issues(self):
-        return self.get_stories('state:unscheduled,unstarted,started,rejected type:bug')
+    def known_issues(self, lazy=False, fields=SUMMARY):
+        return self._stories('state:unscheduled,unstarted,started,rejected type:bug', lazy, fields)
 
-    def open_stories(self, owner=None):
+    def all_stories(self, lazy=False, fields=DETAILS):
+        """every story, including the ones accepted in done iterations"""
+        return self._stories('includedone:true', lazy, fields)
+
+    def open_stories(self, owner=None, lazy=False, fields=SUMMARY):
         search_string = 'state:unscheduled,unstarted,rejected,started,finished'
         if owner is not None:
             search_string += " owner:{}".format(owner)
-        return self.get_stories(search_string)
+        return self._stories(search_string, lazy, fields)
+
+
+class V3Backend(object):
+    """Talks to the v3 API: XML, with every field of every story"""
+
+    URL = 'https://www.pivotaltracker.com/services/v3'
+
+    def all_projects(self):
+        response = _perform_pivotal_get('{}/projects'.format(self.URL))
+        root = ET.fromstring(response.content)
+        return [Project.from_node(project_node) for project_node in root]
+
+    def stories_url(self, project, filter_string):
+        story_filter = quote(filter_string.encode('utf-8'), safe=b'')
+        return '{}/projects/{}/stories?filter={}'.format(
+            self.URL, project.project_id, story_filter)
+
+    def get_stories(self, project, filter_string, fields):
+        response = _perform_pivotal_get(self.stories_url(project, filter_string))
+        stories_root = ET.fromstring(response.content)
+        return [Story.from_node(story_node) for story_node in stories_root]
+
+    def iter_stories(self, project, filter_string, fields):
+        response = _perform_pivotal_get(self.stories_url(project, filter_string),
+                                        stream=True)
+        try:
+            response.raw.decode_content = True
+            depth = 0
+            root = None
+            for event, node in ET.iterparse(response.raw, events=('start', 'end')):
+                if event == 'start':
+                    if root is None:
+                        root = node
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1:
+                    yield Story.from_node(node)
+                    # Drop the parsed story from the tree, so that memory
+                    # stays constant however many stories there are
+                    root.clear()
+        finally:
+            response.close()
+
+    def load_story(self, project, story_id):
+        response = _perform_pivotal_get('{}/projects/{}/stories/{}'.format(
+            self.URL, project.project_id, story_id))
+        if response.status_code == 404:
+            return None
+        return Story.from_node(ET.fromstring(response.content))
+
+    def create_story(self, project, story_dict):
+        story_xml = dicttoxml.dicttoxml(story_dict, root=False)
+        _perform_pivotal_post('{}/projects/{}/stories'.format(
+            self.URL, project.project_id), story_xml)
+
+    def update_story(self, story, changes):
+        """changes fields of a story, sent as query parameters"""
+        query = '&'.join('story[{}]={}'.format(key, quote('{}'.format(value)))
+                         for key, value in sorted(changes.items()))
+        return _perform_pivotal_put('{}/projects/{}/stories/{}?{}'.format(
+            self.URL, story.project_id, story.story_id, query))
+
+
+class V5Backend(object):
+    """Talks to the v5 API: JSON, with only the fields each command needs"""
+
+    FIELDS = {SUMMARY: v5.SUMMARY_FIELDS, DETAILS: v5.DETAILS_FIELDS}
+
+    def all_projects(self):
+        response = _perform_pivotal_get(v5.projects_url())
+        response.raise_for_status()
+        return [Project.from_json(data) for data in v5.loads(response.content)]
+
+    def get_stories(self, project, filter_string, fields):
+        return list(self.iter_stories(project, filter_string, fields))
+
+    def iter_stories(self, project, filter_string, fields):
+        """yields the stories one page at a time"""
+        offset = 0
+        while True:
+            response = _perform_pivotal_get(v5.stories_page_url(
+                project.project_id, filter_string, self.FIELDS[fields], offset))
+            response.raise_for_status()
+            page = v5.loads(response.content)
+            for data in page:
+                yield Story.from_json(data, summary=fields == SUMMARY)
+            if v5.last_page(response, offset, page):
+                return
+            offset += len(page)
+
+    def load_story(self, project, story_id):
+        response = _perform_pivotal_get(
+            v5.story_url(project.project_id, story_id, v5.DETAILS_FIELDS))
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return Story.from_json(v5.loads(response.content))
+
+    def create_story(self, project, story_dict):
+        _perform_pivotal_post(
+            v5.stories_url(project.project_id),
+            v5.dumps(v5.story_payload(story_dict['story'])),
+            content_type='application/json')
+
+    def update_story(self, story, changes):
+        """changes fields of a story, sent as a JSON body"""
+        return _perform_pivotal_put(v5.story_url(story.project_id, story.story_id),
+                                    v5.dumps(changes))
+
+
+BACKENDS = {'3': V3Backend, '5': V5Backend}
+
+# Makes the requests for the API_VERSION in use, and parses its responses
+_backend = BACKENDS.get(API_VERSION, V3Backend)()
+
+
+def _parsed(story):
+    for listener in STORY_LISTENERS:
+        listener(story)
+    return story
+
+
+def _listed(projects):
+    for listener in PROJECT_LISTENERS:
+        listener(projects)
+    return projects
 
 
 # TODO Handle requests.exceptions.ConnectionError
 
-def _perform_pivotal_get(url):
-    headers = {'X-TrackerToken': TOKEN}
+def _perform_pivotal_get(url, stream=False, headers=None):
+    headers = dict(headers or {})
+    headers['X-TrackerToken'] = TOKEN
     # print(url)
-    response = requests.get(url, headers=headers)
+    response = _transport.request('GET', url, headers=headers, stream=stream)
     return response
 
 
-def _perform_pivotal_put(url):
-    headers = {'X-TrackerToken': TOKEN, 'Content-Length': 0}
-    response = requests.put(url, headers=headers)
+def _perform_pivotal_head(url):
+    response = _perform_attachment_request('HEAD', url)
+    response.raise_for_status()
+    return response
+
+
+def _perform_attachment_request(method, url, headers=None, stream=False):
+    """Attachment bodies are redirected to external storage.  The redirects
+    are followed here, without the token: it is only ever sent to pivotal"""
+    headers = dict(headers or {})
+    headers['X-TrackerToken'] = TOKEN
+    for _ in range(MAX_REDIRECTS + 1):
+        response = _transport.request(method, url, headers=headers,
+                                      stream=stream, allow_redirects=False)
+        location = response.headers.get('Location')
+        if response.status_code not in REDIRECT_STATUSES or not location:
+            return response
+        response.close()
+        url = urljoin(url, location)
+        headers.pop('X-TrackerToken', None)
+    raise requests.TooManyRedirects(
+        'Exceeded {} redirects for {}'.format(MAX_REDIRECTS, url))
+
+
+def _perform_pivotal_put(url, payload_json=None):
+    headers = {'X-TrackerToken': TOKEN}
+    if payload_json is None:
+        headers['Content-Length'] = '0'
+    else:
+        headers['Content-type'] = "application/json"
+    response = _transport.request('PUT', url, headers=headers,
+                                  data=payload_json)
     response.raise_for_status()
     return response
 
-def _perform_pivotal_post(url,payload_xml):
-    headers = {'X-TrackerToken': TOKEN, 'Content-type': "application/xml"}
-    response = requests.post(url, data=payload_xml, headers=headers)
+def _perform_pivotal_post(url,payload_xml, content_type="application/xml"):
+    headers = {'X-TrackerToken': TOKEN, 'Content-type': content_type}
+    response = _transport.request('POST', url, headers=headers,
+                                  data=payload_xml)
     response.raise_for_status()
     return response
 
@@ -0,0 +1,109 @@
+# Core Imports
+from __future__ import unicode_literals
+import os
+import struct
+import sys
+
+# 3rd Party Imports
+from termcolor import colored
+
+# Moves the cursor home and clears the screen, instead of forking `clear`
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+
+DEFAULT_SIZE = (24, 80)
+
+
+def terminal_size(stream=None):
+    """returns (rows, cols) of the terminal, without forking `stty size`"""
+    stream = stream or sys.stdout
+    try:
+        fd = stream.fileno()
+    except (AttributeError, ValueError, IOError):
+        fd = None
+
+    if fd is not None:
+        if hasattr(os, 'get_terminal_size'):
+            try:
+                cols, rows = os.get_terminal_size(fd)
+                return rows, cols
+            except OSError:
+                pass
+        else:
+            try:
+                import fcntl
+                import termios
+                size = fcntl.ioctl(fd, termios.TIOCGWINSZ, b'\0' * 8)
+                rows, cols = struct.unpack(str('hhhh'), size)[:2]
+                if rows > 0 and cols > 0:
+                    return rows, cols
+            except (ImportError, IOError):
+                pass
+
+    try:
+        return int(os.environ['LINES']), int(os.environ['COLUMNS'])
+    except (KeyError, ValueError):
+        return DEFAULT_SIZE
+
+
+class Style(object):
+    """The color sequences for a report, computed once rather than for every
+    colored string.  A plain style leaves text uncolored, for piping"""
+
+    def __init__(self, color=True):
+        self.color = color
+        self._bold = self._sequences('white', ['bold'])
+        self._link = self._sequences('blue', ['underline'])
+        self._blue = self._sequences('blue')
+        self._red = self._sequences('red')
+
+    def _sequences(self, color, attrs=None):
+        if not self.color:
+            return '', ''
+        start, end = colored('\0', color, attrs=attrs).split('\0')
+        return start, end
+
+    def bold(self, text):
+        return self._bold[0] + text + self._bold[1]
+
+    def link(self, text):
+        return self._link[0] + text + self._link[1]
+
+    def blue(self, text):
+        return self._blue[0] + text + self._blue[1]
+
+    def red(self, text):
+        return self._red[0] + text + self._red[1]
+
+
+COLOR = Style()
+PLAIN = Style(color=False)
+
+
+def initials(full_name):
+    """Return the initials of a passed in name"""
+
+    if full_name is not None and len(full_name) > 0:
+        return ''.join([s[0] for s in full_name.split(' ')]).upper()
+    else:
+        return ''
+
+
+def output_encoding(stream=None):
+    stream = stream or sys.stdout
+    return getattr(stream, 'encoding', None) or 'utf-8'
+
+
+def write_lines(lines, clear=False, stream=None):
+    """Writes a whole screen of lines to the stream in one buffered write"""
+    stream = stream or sys.stdout
+    output = '\n'.join(lines + [''])
+    if clear:
+        output = CLEAR_SCREEN + output
+    output = output.encode(output_encoding(stream), 'replace')
+
+    # Python 3 wants bytes written to the underlying buffer, after anything
+    # already printed to the stream itself
+    stream.flush()
+    buffer = getattr(stream, 'buffer', stream)
+    buffer.write(output)
+    buffer.flush()
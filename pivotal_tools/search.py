@@ -0,0 +1,275 @@
+# Core Imports
+from __future__ import unicode_literals
+import bisect
+import json
+import math
+import os
+import re
+import threading
+
+from pivotal_tools.storage import data_path, locked, write_atomically
+
+# Bumped whenever the documents change shape (2: documents hold the labels)
+INDEX_VERSION = 2
+
+# How much a match in each part of a story counts towards its rank
+NAME_WEIGHT = 3
+LABEL_WEIGHT = 2
+TEXT_WEIGHT = 1
+
+# Stories queued to be indexed at most.  Past that, they are merged into the
+# index right away, so a long command does not hold every story it fetched
+MAX_PENDING = 1000
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return WORD.findall(text.lower())
+
+
+def story_terms(story):
+    """term -> weighted count for the searchable text of a story: its name,
+    labels, description, notes and tasks"""
+    terms = {}
+
+    def add(text, weight):
+        for term in tokenize(text):
+            terms[term] = terms.get(term, 0) + weight
+
+    add(story.name, NAME_WEIGHT)
+    add(story.labels, LABEL_WEIGHT)
+    add(story.description, TEXT_WEIGHT)
+    for note in story.notes:
+        add(note.text, TEXT_WEIGHT)
+    for task in story.tasks:
+        add(task.description, TEXT_WEIGHT)
+    return terms
+
+
+class SearchIndex(object):
+    """Persistent inverted index over the stories the tool has fetched.
+
+    Stories are added as they are parsed (from any thread), and only merged
+    into the index file when it is saved, so commands that do not search
+    never pay for loading it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or data_path('search_index.json')
+        self.docs = None
+        self.postings = None
+        self._sorted_terms = None
+        self._added = []
+        # The stories changed since the index was last saved
+        self._changed = set()
+        self._lock = threading.Lock()
+        # Held while the queued stories are merged, which may happen from the
+        # thread of any fetch
+        self._merge_lock = threading.RLock()
+
+    def add(self, story):
+        """queues a fetched story to be (re)indexed.  A story fetched with
+        only its summary fields keeps the text indexed for it before"""
+        if story.story_id:
+            doc = {
+                'project_id': story.project_id,
+                'name': story.name,
+                'story_type': story.story_type,
+                'state': story.state,
+                'owned_by': story.owned_by,
+                'labels': story.labels,
+            }
+            if not story.summary:
+                doc['terms'] = story_terms(story)
+            with self._lock:
+                self._added.append((story.story_id, doc))
+                full = len(self._added) >= MAX_PENDING
+            if full:
+                self.update()
+
+    def load(self):
+        if self.docs is not None:
+            return
+        self.docs = {}
+        self.postings = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+            if data.get('version') == INDEX_VERSION:
+                self.docs = data['docs']
+                self.postings = data['postings']
+
+    def update(self):
+        """merges the added stories into the index, replacing their old
+        entries.  Stories that did not change are left alone, so that saving
+        does not rewrite the index for nothing.  Returns True if anything
+        was added"""
+        with self._merge_lock:
+            with self._lock:
+                added, self._added = self._added, []
+            if len(added) == 0:
+                return False
+
+            self.load()
+            for story_id, doc in added:
+                old = self.docs.get(story_id)
+                if 'terms' not in doc:
+                    if old is not None and all(old.get(key) == value
+                                               for key, value in doc.items()):
+                        continue
+                    project_id = doc.pop('project_id')
+                    self.apply(story_id, project_id, doc)
+                    continue
+                if old == doc:
+                    continue
+                self.remove(story_id)
+                self._insert(story_id, doc)
+            return True
+
+    def _insert(self, story_id, doc):
+        self.docs[story_id] = doc
+        for term, count in doc['terms'].items():
+            self.postings.setdefault(term, {})[story_id] = count
+        self._sorted_terms = None
+        self._changed.add(story_id)
+
+    def apply(self, story_id, project_id, changes, text=None):
+        """Applies a partial change to a story, as sent by activity web hooks.
+
+        changes maps the changed attributes (name, state, story_type,
+        owned_by, labels) to their new values, and text is any new searchable
+        text, like a note.  Text that was replaced (an old description) can
+        not be taken out, so it stays searchable until the story is fetched
+        again
+        """
+        self.update()
+        self.load()
+        doc = self.remove(story_id) or {
+            'project_id': project_id, 'name': '', 'story_type': '',
+            'state': '', 'owned_by': '', 'labels': '', 'terms': {}}
+        terms = doc['terms']
+
+        def count(text, weight):
+            for term in tokenize(text):
+                terms[term] = terms.get(term, 0) + weight
+                if terms[term] <= 0:
+                    del terms[term]
+
+        for key, weight in [('name', NAME_WEIGHT), ('labels', LABEL_WEIGHT)]:
+            if key in changes:
+                count(doc.get(key), -weight)
+                count(changes[key], weight)
+        count(text, TEXT_WEIGHT)
+
+        doc.update(changes)
+        if project_id is not None:
+            doc['project_id'] = project_id
+        self._insert(story_id, doc)
+
+    def project_for(self, story_id):
+        """the project id of a story, if it has been seen"""
+        self.update()
+        self.load()
+        doc = self.docs.get(story_id)
+        if doc is not None:
+            return doc['project_id']
+        return None
+
+    def remove(self, story_id):
+        """removes a story from the index, and returns its entry"""
+        self.load()
+        doc = self.docs.pop(story_id, None)
+        if doc is None:
+            return None
+        for term in doc['terms']:
+            matches = self.postings.get(term, {})
+            matches.pop(story_id, None)
+            if len(matches) == 0:
+                self.postings.pop(term, None)
+        self._sorted_terms = None
+        self._changed.add(story_id)
+        return doc
+
+    def save(self):
+        """Writes the stories that changed into the index, if any did.
+
+        Other commands (a running listen, a search) save the same file, so it
+        is read again under a lock and only the changed stories are merged
+        into it.  What the others indexed meanwhile is kept
+        """
+        with self._merge_lock:
+            self.update()
+            if len(self._changed) == 0:
+                return
+            with locked(self.path):
+                changed = [(story_id, self.docs.get(story_id))
+                           for story_id in self._changed]
+                self.docs = None
+                self._sorted_terms = None
+                self.load()
+                for story_id, doc in changed:
+                    self.remove(story_id)
+                    if doc is not None:
+                        self._insert(story_id, doc)
+                self._changed = set()
+                data = {'version': INDEX_VERSION, 'docs': self.docs,
+                        'postings': self.postings}
+                write_atomically(self.path, json.dumps(
+                    data, separators=(',', ':')).encode('utf-8'))
+
+    def expand(self, term):
+        """the indexed terms matched by a query term.  A term ending with *
+        matches every term starting with it"""
+        if not term.endswith('*'):
+            return [term] if term in self.postings else []
+
+        prefix = term[:-1]
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        terms = []
+        idx = bisect.bisect_left(self._sorted_terms, prefix)
+        while (idx < len(self._sorted_terms)
+               and self._sorted_terms[idx].startswith(prefix)):
+            terms.append(self._sorted_terms[idx])
+            idx += 1
+        return terms
+
+    def search(self, query, limit=20):
+        """Returns (score, story_id, doc) tuples for the stories matching every
+        term of the query, best match first.  Scores are tf-idf"""
+        self.update()
+        self.load()
+        query_terms = []
+        for word in query.split():
+            terms = tokenize(word)
+            if len(terms) > 0 and word.endswith('*'):
+                terms[-1] += '*'
+            query_terms.extend(terms)
+        if len(query_terms) == 0:
+            return []
+
+        total = float(len(self.docs))
+        scores = None
+        for query_term in query_terms:
+            term_scores = {}
+            for term in self.expand(query_term):
+                matches = self.postings[term]
+                idf = math.log(1 + total / len(matches))
+                for story_id, count in matches.items():
+                    term_scores[story_id] = (term_scores.get(story_id, 0)
+                                             + count * idf)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = dict((story_id, score + term_scores[story_id])
+                              for story_id, score in scores.items()
+                              if story_id in term_scores)
+            if len(scores) == 0:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(score, story_id, self.docs[story_id])
+                for story_id, score in ranked[:limit]]
@@ -0,0 +1,98 @@
+# Core Imports
+from __future__ import unicode_literals
+import gzip
+import io
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from pivotal_tools.pivotal import SUMMARY
+from pivotal_tools.storage import data_path, write_atomically
+
+SNAPSHOT_VERSION = 1
+
+# Name of the snapshot saved by the last changelog of a project
+LAST = 'last'
+
+
+class SnapshotError(ValueError):
+    """a snapshot that is missing, or that this version can not read"""
+
+
+def story_key(story):
+    """the part of a story a changelog cares about"""
+    return [story.state, story.estimate, story.labels]
+
+
+class Snapshot(object):
+    """Compact record of the stories a changelog saw: story_id -> state,
+    estimate and labels"""
+
+    def __init__(self, project_id, taken_at, stories):
+        self.project_id = project_id
+        self.taken_at = taken_at
+        self.stories = stories
+
+    @classmethod
+    def from_stories(cls, project_id, stories):
+        return cls(project_id, time.time(),
+                   dict((story.story_id, story_key(story)) for story in stories))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = json.loads(gzip.GzipFile(fileobj=f).read().decode('utf-8'))
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise SnapshotError('{} is a version {} snapshot, expected {}'.format(
+                path, data.get('version'), SNAPSHOT_VERSION))
+        return cls(data['project_id'], data['taken_at'], data['stories'])
+
+    def save(self, path):
+        data = json.dumps({'version': SNAPSHOT_VERSION,
+                           'project_id': self.project_id,
+                           'taken_at': self.taken_at,
+                           'stories': self.stories},
+                          separators=(',', ':'), sort_keys=True)
+        write_atomically(path, gzip_bytes(data.encode('utf-8')))
+
+    def changed(self, stories):
+        """the stories that are new, or differ from this snapshot"""
+        return [story for story in stories
+                if self.stories.get(story.story_id) != story_key(story)]
+
+    def updated(self, stories):
+        """a new snapshot, with stories replacing their entries in this one"""
+        snapshot = Snapshot(self.project_id, time.time(), dict(self.stories))
+        for story in stories:
+            snapshot.stories[story.story_id] = story_key(story)
+        return snapshot
+
+    def modified_since_filter(self):
+        """pivotal filter for the stories modified after the snapshot was
+        taken.  The filter only has a day resolution, so it starts a day
+        early to be safe across time zones"""
+        since = datetime.utcfromtimestamp(self.taken_at) - timedelta(days=1)
+        return 'includedone:true modified_since:{}'.format(
+            since.strftime('%m/%d/%Y'))
+
+
+def gzip_bytes(data):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def snapshot_path(project_id, name=LAST):
+    """where snapshots are kept.  A name that is a path is used as is"""
+    if name != LAST and (os.sep in name or os.path.exists(name)):
+        return name
+    return data_path('snapshots', '{}-{}.json.gz'.format(project_id, name))
+
+
+def changed_stories(project, snapshot):
+    """Fetches only the stories modified since the snapshot, and returns the
+    ones that actually changed, together with the updated snapshot"""
+    modified = project.get_stories(snapshot.modified_since_filter(), SUMMARY)
+    return snapshot.changed(modified), snapshot.updated(modified)
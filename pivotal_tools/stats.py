@@ -0,0 +1,210 @@
+# Core Imports
+from __future__ import unicode_literals
+from array import array
+
+# numpy is optional: with it the aggregations run as vectorized bincounts,
+# without it they fall back to one plain pass over each column
+try:
+    import numpy
+except ImportError:
+    numpy = None  # flake8: noqa
+
+from pivotal_tools.pivotal import SUMMARY
+
+# Estimate codes, next to the real estimates (which are >= 0)
+UNESTIMATED = -1  # a feature that has not been estimated yet
+NOT_ESTIMABLE = -2  # bugs, chores and releases have no estimate
+
+
+class Categories(object):
+    """Interns the values of a categorical column as small integer codes"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        if value not in self.codes:
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+        return self.codes[value]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class StoryColumns(object):
+    """Columnar, array backed representation of a set of stories, holding
+    just what the stats need: one compact array per attribute, with
+    categorical attributes stored as codes.  Labels are many-to-one, so they
+    are stored as two parallel arrays of (story row, label code)."""
+
+    def __init__(self):
+        self.estimates = array(str('i'))
+        self.states = array(str('i'))
+        self.types = array(str('i'))
+        self.owners = array(str('i'))
+        self.label_rows = array(str('i'))
+        self.label_codes = array(str('i'))
+        self.state_names = Categories()
+        self.type_names = Categories()
+        self.owner_names = Categories()
+        self.label_names = Categories()
+
+    def __len__(self):
+        return len(self.estimates)
+
+    @classmethod
+    def from_stories(cls, stories):
+        """builds the columns from an iterable of stories, one at a time"""
+        columns = cls()
+        for story in stories:
+            columns.append(story)
+        return columns
+
+    def append(self, story):
+        row = len(self.estimates)
+        if story.estimate is None:
+            self.estimates.append(NOT_ESTIMABLE)
+        else:
+            self.estimates.append(max(story.estimate, UNESTIMATED))
+        self.states.append(self.state_names.code(story.state))
+        self.types.append(self.type_names.code(story.story_type))
+        self.owners.append(self.owner_names.code(story.owned_by or ''))
+        if story.labels:
+            for label in story.labels.split(','):
+                self.label_rows.append(row)
+                self.label_codes.append(self.label_names.code(label.strip()))
+
+    def points(self):
+        """the points of each story, 0 for unestimated ones"""
+        if numpy is not None:
+            return numpy.maximum(numpy.frombuffer(self.estimates, dtype=numpy.intc), 0)
+        return array(str('i'), [max(estimate, 0) for estimate in self.estimates])
+
+
+def bincount(codes, size, weights=None):
+    """count (or sum of weights) of each code from 0 to size - 1"""
+    if numpy is not None:
+        codes = numpy.frombuffer(codes, dtype=numpy.intc)
+        if weights is not None:
+            weights = numpy.asarray(weights)
+        return [int(total) for total in
+                numpy.bincount(codes, weights=weights, minlength=size)[:size]]
+
+    totals = [0] * size
+    if weights is None:
+        for code in codes:
+            totals[code] += 1
+    else:
+        for code, weight in zip(codes, weights):
+            totals[code] += weight
+    return totals
+
+
+def total(values):
+    """the sum of values"""
+    if numpy is not None:
+        return int(numpy.asarray(values).sum())
+    return sum(values)
+
+
+def count_matching(codes, code, values, value):
+    """the number of rows where codes is code and values is value"""
+    if numpy is not None:
+        return int(numpy.count_nonzero(
+            (numpy.frombuffer(codes, dtype=numpy.intc) == code)
+            & (numpy.frombuffer(values, dtype=numpy.intc) == value)))
+    return len([row for row in range(len(codes))
+                if codes[row] == code and values[row] == value])
+
+
+def take(values, rows):
+    """values[row] for each row"""
+    if numpy is not None:
+        return numpy.asarray(values)[numpy.frombuffer(rows, dtype=numpy.intc)]
+    return [values[row] for row in rows]
+
+
+class Stats(object):
+    """The aggregate statistics of a StoryColumns, each computed with one
+    pass over the columns it needs"""
+
+    def __init__(self, columns, point_scale=None):
+        self.total = len(columns)
+        points = columns.points()
+        self.points = total(points)
+
+        self.points_by_state = self._named(
+            columns.state_names,
+            bincount(columns.states, len(columns.state_names), points))
+        self.points_by_owner = self._named(
+            columns.owner_names,
+            bincount(columns.owners, len(columns.owner_names), points))
+        self.points_by_label = self._named(
+            columns.label_names,
+            bincount(columns.label_codes, len(columns.label_names),
+                     take(points, columns.label_rows)))
+
+        counts_by_type = dict(zip(
+            columns.type_names.values,
+            bincount(columns.types, len(columns.type_names))))
+        self.features = counts_by_type.get('feature', 0)
+        self.bugs = counts_by_type.get('bug', 0)
+        self.chores = counts_by_type.get('chore', 0)
+
+        # Projects that estimate bugs and chores have them unestimated too,
+        # but only the features are counted (and compared to self.features)
+        self.unestimated = 0
+        if 'feature' in columns.type_names.codes:
+            self.unestimated = count_matching(
+                columns.types, columns.type_names.codes['feature'],
+                columns.estimates, UNESTIMATED)
+
+        by_estimate = self._estimate_counts(columns.estimates)
+        by_estimate.pop(UNESTIMATED, None)
+        by_estimate.pop(NOT_ESTIMABLE, None)
+
+        scale = [int(point) for point in (point_scale or []) if point.isdigit()]
+        for point in scale:
+            by_estimate.setdefault(point, 0)
+        self.estimate_distribution = sorted(by_estimate.items())
+
+    @staticmethod
+    def _named(categories, totals):
+        return sorted(zip(categories.values, totals),
+                      key=lambda item: (-item[1], item[0]))
+
+    @staticmethod
+    def _estimate_counts(estimates):
+        if len(estimates) == 0:
+            return {}
+        # Shift the estimates so that NOT_ESTIMABLE is counted in bin 0
+        offset = -NOT_ESTIMABLE
+        if numpy is not None:
+            shifted = numpy.frombuffer(estimates, dtype=numpy.intc) + offset
+            counts = numpy.bincount(shifted)
+        else:
+            counts = bincount(array(str('i'), [e + offset for e in estimates]),
+                              max(estimates) + offset + 1)
+        return dict((value - offset, int(count))
+                    for value, count in enumerate(counts) if count > 0)
+
+    @property
+    def unestimated_share(self):
+        """share of the features that are still unestimated"""
+        if self.features == 0:
+            return 0.0
+        return float(self.unestimated) / self.features
+
+    @property
+    def bugs_per_feature(self):
+        if self.features == 0:
+            return None
+        return float(self.bugs) / self.features
+
+
+def project_stats(project):
+    """Streams every story of the project into columns, and aggregates them"""
+    columns = StoryColumns.from_stories(project.all_stories(lazy=True, fields=SUMMARY))
+    return Stats(columns, project.point_scale)
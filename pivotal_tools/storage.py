@@ -0,0 +1,58 @@
+# Core Imports
+from __future__ import unicode_literals
+import os
+import tempfile
+from contextlib import contextmanager
+
+# fcntl is only on unix: elsewhere files are not locked against other
+# processes, and only one pivotal_tools should run at a time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # flake8: noqa
+
+DATA_DIR = os.getenv('PIVOTAL_TOOLS_HOME',
+                     os.path.join(os.path.expanduser('~'), '.pivotal_tools'))
+
+
+def data_path(*parts):
+    """returns the path to a file in the local data directory, creating its
+    directory if needed"""
+    path = os.path.join(DATA_DIR, *parts)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return path
+
+
+def write_atomically(path, data):
+    """writes bytes to path, so that readers see either the old or the new
+    content, never half of it"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def locked(path):
+    """holds a lock on path against other processes, through a .lock file
+    next to it"""
+    with open(path + '.lock', 'ab') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,213 @@
+# Core Imports
+from __future__ import unicode_literals
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+# 3rd Party Imports
+import requests
+
+CASSETTE_VERSION = 1
+MAGIC = b'PTCASSETTE\n'
+
+# The offset of the index, at the very end of a cassette
+FOOTER = struct.Struct(str('>Q'))
+
+# Request headers that change the response, and so are part of its key.
+# Nothing else from the request (in particular not the token) is recorded
+KEY_HEADERS = ('Range', 'If-Range')
+
+# The body a recorded response holds is already decoded
+DROPPED_HEADERS = ('content-encoding', 'transfer-encoding')
+
+
+class CassetteError(Exception):
+    """the cassette is damaged, or holds no response for a request"""
+
+
+def request_key(method, url, headers=None, data=None):
+    """what identifies a request in a cassette"""
+    headers = headers or {}
+    key = [method.upper(), url]
+    key.extend(headers.get(name) or '' for name in KEY_HEADERS)
+    if data:
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        key.append(hashlib.sha1(data).hexdigest())
+    return '\n'.join(key)
+
+
+class Response(object):
+    """A recorded response, standing in for a requests.Response.  The body is
+    only copied out of the cassette when it is first read"""
+
+    def __init__(self, url, status_code, headers, body):
+        self.url = url
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self._body = body
+        self._raw = None
+
+    @property
+    def content(self):
+        if callable(self._body):
+            self._body = self._body()
+        return self._body
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            self._raw = io.BytesIO(self.content)
+        return self._raw
+
+    def iter_content(self, chunk_size=1):
+        content = self.content
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise requests.HTTPError('{} Error for url: {}'.format(
+                self.status_code, self.url), response=self)
+
+    def close(self):
+        pass
+
+
+class HttpTransport(object):
+    """Sends the requests over a requests.Session"""
+
+    def __init__(self, session):
+        self.session = session
+
+    def request(self, method, url, headers=None, data=None, stream=False,
+                allow_redirects=True):
+        return self.session.request(method, url, headers=headers, data=data,
+                                    stream=stream,
+                                    allow_redirects=allow_redirects)
+
+    def close(self):
+        pass
+
+
+class RecordingTransport(object):
+    """Sends the requests through another transport, and records every
+    response into a cassette.
+
+    The bodies are appended to the cassette as they come in, and the index
+    of the requests is written after them on close.  The cassette is written
+    under a temporary name, and only moved in place once complete
+    """
+
+    def __init__(self, path, transport):
+        self.path = path
+        self.transport = transport
+        self._tmp_path = path + '.tmp'
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(MAGIC)
+        self._interactions = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, data=None, stream=False,
+                allow_redirects=True):
+        response = self.transport.request(method, url, headers=headers,
+                                          data=data, stream=stream,
+                                          allow_redirects=allow_redirects)
+        try:
+            content = response.content
+        finally:
+            response.close()
+
+        recorded_headers = dict((name, value) for name, value
+                                in response.headers.items()
+                                if name.lower() not in DROPPED_HEADERS)
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(content)
+            self._interactions.append({
+                'key': request_key(method, url, headers, data),
+                'status': response.status_code,
+                'headers': recorded_headers,
+                'offset': offset,
+                'length': len(content),
+            })
+        return Response(url, response.status_code, recorded_headers, content)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            index_offset = self._file.tell()
+            self._file.write(json.dumps(
+                {'version': CASSETTE_VERSION,
+                 'interactions': self._interactions},
+                separators=(',', ':')).encode('utf-8'))
+            self._file.write(FOOTER.pack(index_offset))
+            self._file.close()
+            self._file = None
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self._tmp_path, self.path)
+
+
+class ReplayTransport(object):
+    """Serves the responses of a cassette, without a network.
+
+    The cassette is memory mapped, so only the index is read up front, and
+    each body is paged in when a response is read.  A request recorded more
+    than once gets the recorded responses in order, then the last one again.
+    latency is the number of seconds each request waits, to simulate a slow
+    connection
+    """
+
+    def __init__(self, path, latency=0):
+        self.path = path
+        self.latency = latency
+        self._lock = threading.Lock()
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        size = len(self._map)
+        if (size < len(MAGIC) + FOOTER.size
+                or self._map[:len(MAGIC)] != MAGIC):
+            raise CassetteError('{} is not a cassette'.format(path))
+        index_offset, = FOOTER.unpack(self._map[size - FOOTER.size:])
+        try:
+            index = json.loads(
+                self._map[index_offset:size - FOOTER.size].decode('utf-8'))
+        except ValueError:
+            raise CassetteError('{} is damaged, its index is unreadable'.format(path))
+        if index.get('version') != CASSETTE_VERSION:
+            raise CassetteError('{} is a version {} cassette, expected {}'.format(
+                path, index.get('version'), CASSETTE_VERSION))
+
+        self._interactions = {}
+        for interaction in index['interactions']:
+            self._interactions.setdefault(interaction['key'], []).append(interaction)
+
+    def request(self, method, url, headers=None, data=None, stream=False,
+                allow_redirects=True):
+        key = request_key(method, url, headers, data)
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                raise CassetteError('{} has no response for {} {}'.format(
+                    self.path, method.upper(), url))
+            interaction = recorded.pop(0) if len(recorded) > 1 else recorded[0]
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        start = interaction['offset']
+        end = start + interaction['length']
+        return Response(url, interaction['status'], interaction['headers'],
+                        lambda: self._map[start:end])
+
+    def close(self):
+        self._map.close()
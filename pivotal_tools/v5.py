@@ -0,0 +1,91 @@
+# Core Imports
+from __future__ import unicode_literals
+try:
+    from urllib.parse import quote as quote
+except ImportError:
+    from urllib import quote  # flake8: noqa
+
+# The fastest JSON decoder available: ujson or simplejson when installed,
+# json otherwise
+try:
+    import ujson as json
+except ImportError:
+    try:
+        import simplejson as json  # flake8: noqa
+    except ImportError:
+        import json  # flake8: noqa
+
+API_URL = 'https://www.pivotaltracker.com/services/v5'
+FILES_URL = 'https://www.pivotaltracker.com'
+
+# Stories per page.  v5 lists are paginated, 500 is the most a page can hold
+PAGE_SIZE = 500
+
+# What a report shows of a story
+SUMMARY_FIELDS = ('id,project_id,name,story_type,current_state,estimate,url,'
+                  'labels(name),owners(name)')
+
+# Everything a story is shown with, including its notes, tasks and attachments
+DETAILS_FIELDS = (SUMMARY_FIELDS + ',description,tasks(id,description,complete),'
+                  'comments(id,text,person(name),'
+                  'file_attachments(id,filename,download_url))')
+
+PROJECT_FIELDS = 'id,name,point_scale'
+
+# Headers v5 describes the pagination of a list with
+TOTAL_HEADER = 'X-Tracker-Pagination-Total'
+
+
+def loads(content):
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    return json.loads(content)
+
+
+def dumps(data):
+    return json.dumps(data).encode('utf-8')
+
+
+def _query(**params):
+    """the query string of params.  Field lists are left readable"""
+    return '&'.join(
+        '{}={}'.format(key, quote('{}'.format(value).encode('utf-8'), safe=b',()'))
+        for key, value in sorted(params.items()))
+
+
+def projects_url():
+    return '{}/projects?{}'.format(API_URL, _query(fields=PROJECT_FIELDS))
+
+
+def stories_url(project_id):
+    return '{}/projects/{}/stories'.format(API_URL, project_id)
+
+
+def stories_page_url(project_id, filter_string, fields, offset=0):
+    """a page of the stories matching a filter"""
+    return '{}?{}'.format(stories_url(project_id), _query(
+        filter=filter_string, fields=fields, limit=PAGE_SIZE, offset=offset))
+
+
+def story_url(project_id, story_id, fields=None):
+    url = '{}/{}'.format(stories_url(project_id), story_id)
+    if fields is not None:
+        url += '?' + _query(fields=fields)
+    return url
+
+
+def last_page(response, offset, page):
+    """whether a page of a list is its last one"""
+    total = response.headers.get(TOTAL_HEADER)
+    if total is not None:
+        return offset + len(page) >= int(total)
+    return len(page) < PAGE_SIZE
+
+
+def story_payload(story):
+    """the v5 form of a (v3 shaped) create_story payload"""
+    payload = dict(story)
+    if payload.get('labels'):
+        payload['labels'] = [{'name': label.strip()}
+                             for label in payload['labels'].split(',')]
+    return payload
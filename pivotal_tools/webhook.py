@@ -0,0 +1,62 @@
+# Core Imports
+from __future__ import unicode_literals
+import xml.etree.ElementTree as ET
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # flake8: noqa
+
+from pivotal_tools.pivotal import Activity
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+STORY_DELETE = 'story_delete'
+
+
+def apply_activity(index, activity):
+    """applies an activity to the cached stories of a SearchIndex"""
+    for story_id, changes, text in activity.stories:
+        if activity.event_type == STORY_DELETE:
+            index.remove(story_id)
+        else:
+            index.apply(story_id, activity.project_id, changes, text)
+
+
+class ActivityHandler(BaseHTTPRequestHandler):
+    """Receives activity web hooks, and applies them to server.index"""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        content = self.rfile.read(length)
+        try:
+            activity = Activity.from_node(ET.fromstring(content))
+        except ET.ParseError as e:
+            self._respond(400, 'Could not parse activity: {}'.format(e))
+            return
+
+        apply_activity(self.server.index, activity)
+        self.server.index.save()
+        self.server.on_activity(activity)
+        self._respond(200, 'OK')
+
+    def _respond(self, status, message):
+        body = (message + '\n').encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(index, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                on_activity=None):
+    """an HTTP server applying the activities posted to it to the index.
+    on_activity is called with every activity applied"""
+    server = HTTPServer((host, port), ActivityHandler)
+    server.index = index
+    server.on_activity = on_activity or (lambda activity: None)
+    return server
@@ -0,0 +1,102 @@
+from __future__ import unicode_literals
+import gzip
+import threading
+
+import pytest
+
+from pivotal_tools.archive import (
+    ArchiveError, export_project, import_archive, read_archive)
+from pivotal_tools.pivotal import Note
+
+from test_cli import StoryFactory
+
+
+class FakeProject(object):
+    project_id = '43'
+    name = 'Test'
+    point_scale = ['0', '1', '2']
+
+    def __init__(self, fail_on=()):
+        self.created = []
+        self.fail_on = fail_on
+
+    def create_story(self, story_dict):
+        if story_dict['story']['name'] in self.fail_on:
+            raise IOError('timed out')
+        self.created.append(story_dict['story'])
+
+
+def stories():
+    return [StoryFactory(story_id=str(n), name='Story {}'.format(n),
+                         notes=[Note('9', 'a note', 'SP')], tasks=[],
+                         attachments=[])
+            for n in range(5)]
+
+
+def test_export_and_read(tmpdir):
+    path = str(tmpdir.join('export.jsonl.gz'))
+    manifest = export_project(FakeProject(), path, stories())
+
+    assert manifest['stories'] == 5
+    records = list(read_archive(path))
+    assert [record['story_id'] for record in records] == ['0', '1', '2', '3', '4']
+    assert records[0]['notes'] == [
+        {'note_id': '9', 'text': 'a note', 'author': 'SP'}]
+
+
+def test_damaged_archive(tmpdir):
+    path = str(tmpdir.join('export.jsonl.gz'))
+    export_project(FakeProject(), path, stories())
+    with gzip.open(path, 'rb') as f:
+        lines = f.readlines()
+    with gzip.open(path, 'wb') as f:
+        f.writelines(lines[:2] + lines[3:])
+
+    with pytest.raises(ArchiveError):
+        list(read_archive(path))
+
+
+def test_import_resumes(tmpdir):
+    path = str(tmpdir.join('export.jsonl.gz'))
+    export_project(FakeProject(), path, stories())
+
+    project = FakeProject(fail_on=['Story 3'])
+    errors = [error for record, error in import_archive(project, path)]
+    assert len([error for error in errors if error is not None]) == 1
+    assert sorted(story['name'] for story in project.created) == [
+        'Story 0', 'Story 1', 'Story 2', 'Story 4']
+
+    project = FakeProject()
+    list(import_archive(project, path))
+    assert [story['name'] for story in project.created] == ['Story 3']
+
+
+class SlowFirstProject(FakeProject):
+    """creates Story 0 only once the stories after it were created"""
+
+    def __init__(self):
+        FakeProject.__init__(self)
+        self.others_created = threading.Event()
+
+    def create_story(self, story_dict):
+        if story_dict['story']['name'] == 'Story 0':
+            self.others_created.wait(5)
+        FakeProject.create_story(self, story_dict)
+        if len(self.created) == 3:
+            self.others_created.set()
+
+
+def test_import_records_stories_created_ahead_of_an_interruption(tmpdir):
+    path = str(tmpdir.join('export.jsonl.gz'))
+    export_project(FakeProject(), path, stories())
+
+    project = SlowFirstProject()
+    imports = import_archive(project, path)
+    record, error = next(imports)
+    assert (record['story_id'], error) == ('0', None)
+    imports.close()
+    assert len(project.created) == 4
+
+    project = FakeProject()
+    list(import_archive(project, path))
+    assert [story['name'] for story in project.created] == ['Story 4']
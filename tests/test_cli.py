@@ -2,8 +2,11 @@ from __future__ import unicode_literals
 from datetime import datetime
 
 import factory
+import pytest
+from docopt import docopt
 
 from pivotal_tools import cli
+from pivotal_tools.journal import Journal
 
 
 class StoryFactory(factory.StubFactory):
@@ -17,6 +20,10 @@ class StoryFactory(factory.StubFactory):
     state = 'started'
     url = 'http://example.com'
     labels = None
+    notes = factory.LazyFunction(list)
+    tasks = factory.LazyFunction(list)
+    attachments = factory.LazyFunction(list)
+    summary = False
 
 
 def test_stories():
@@ -59,3 +66,90 @@ def test_scrum_with_state(monkeypatch):
 
 def test_decode_dict():
     assert cli.decode_dict(dict(a=b'\xc3\xb8'), 'utf-8') == dict(a='\xf8')
+
+
+class ProjectFactory(factory.StubFactory):
+    project_id = '43'
+    name = 'Test'
+
+
+def test_merge_reports_skips_failed_projects(monkeypatch, capsys):
+    def queries(project, arguments):
+        if project.name == 'Broken':
+            raise IOError('timed out')
+        return (project.name,)
+
+    def render(project, results, arguments):
+        return ['{} report'.format(*results)]
+
+    projects = [ProjectFactory(name='One'), ProjectFactory(name='Broken'),
+                ProjectFactory(name='Two')]
+    assert (cli.merge_reports(projects, {}, queries, render)
+            == ['One report', 'Two report'])
+    assert 'Could not fetch Broken: timed out' in capsys.readouterr().err
+
+
+def test_usage():
+    arguments = docopt(cli.__doc__, ['scrum', '--all-projects'])
+    assert arguments['scrum'] and arguments['--all-projects']
+    arguments = docopt(cli.__doc__, ['start', 'story', '42', '--queue'])
+    assert arguments['start'] and arguments['--queue']
+
+
+def test_scrum_uncolored_for_project_index(monkeypatch):
+    monkeypatch.setattr(cli, 'pretty_date', lambda: 'Oct 27, 2013')
+    lines = cli.render_scrum(
+        ProjectFactory(), ([StoryFactory()], []), {'--project-index': '1'})
+    assert lines[0] == 'Test SCRUM -- Oct 27, 2013'
+
+
+class FakeProject(object):
+    def __init__(self, project_id, story_ids):
+        self.project_id = project_id
+        self.name = project_id
+        self.story_ids = story_ids
+        self.filters = []
+
+    def get_stories(self, filter_string):
+        self.filters.append(filter_string)
+        requested = filter_string.split()[0][len('id:'):].split(',')
+        return [StoryFactory(story_id=story_id, project_id=self.project_id)
+                for story_id in requested if story_id in self.story_ids]
+
+
+class FakeIndex(object):
+    def project_for(self, story_id):
+        return {'1': 'A', '3': 'B'}.get(story_id)
+
+
+def test_fetch_stories_batches_by_project(monkeypatch):
+    projects = [FakeProject('A', ['1', '2']), FakeProject('B', ['3'])]
+    monkeypatch.setattr(cli.Project, 'all', staticmethod(lambda: projects))
+
+    fetched = list(cli.fetch_stories(['3', '2', '1', '9', '3'],
+                                     {'--project-index': None}, FakeIndex()))
+    assert ([(story_id, story and story.project_id) for story_id, story in fetched]
+            == [('3', 'B'), ('2', 'A'), ('1', 'A'), ('9', None), ('3', 'B')])
+    assert projects[0].filters == ['id:1,2,9 includedone:true']
+    assert projects[1].filters == ['id:3,2,9 includedone:true']
+
+
+def test_poker_estimates_can_be_queued(tmpdir, monkeypatch):
+    monkeypatch.setattr(cli, 'raw_input', lambda prompt: '2', raising=False)
+    log = Journal(str(tmpdir.join('journal.jsonl')))
+    project = ProjectFactory(point_scale=['0', '1', '2'])
+
+    cli.prompt_estimation(project, StoryFactory(), journal=log)
+    assert [(entry['story_id'], entry['value'], entry['project_id'])
+            for entry in log.entries()] == [('42', 2, '43')]
+
+
+def test_changelog_since_a_missing_snapshot(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(cli, 'recent_project', lambda: None)
+    monkeypatch.setattr(cli, 'prompt_project', lambda arguments: ProjectFactory())
+    arguments = {'--since': str(tmpdir.join('release-1')),
+                 '--all-projects': False}
+
+    with pytest.raises(SystemExit):
+        cli.changelog_report(arguments)
+    assert 'No changelog snapshot' in capsys.readouterr().out
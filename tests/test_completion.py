@@ -0,0 +1,45 @@
+from __future__ import unicode_literals
+
+from pivotal_tools.completion import CompletionIndex, completion_script
+
+from test_cli import ProjectFactory, StoryFactory
+
+
+def test_index_keeps_the_recent_stories_first(tmpdir, monkeypatch):
+    monkeypatch.setattr('pivotal_tools.completion.MAX_STORIES', 2)
+    path = str(tmpdir.join('completion.tsv'))
+    index = CompletionIndex(path)
+    index.set_projects([ProjectFactory(project_id='43', name='Web'),
+                        ProjectFactory(project_id='44', name='Api')])
+    index.add(StoryFactory(story_id='1', project_id='43', name='Login\tpage'))
+    index.save()
+
+    index = CompletionIndex(path)
+    index.add(StoryFactory(story_id='2', project_id='44', name='Billing',
+                           owned_by='Other One'))
+    index.add(StoryFactory(story_id='3', project_id='44', name='Invoices'))
+    index.save()
+
+    rows = index.read()
+    assert rows['s'] == [['3', '2', 'SP', 'Invoices', '44'],
+                         ['2', '2', 'OO', 'Billing', '44']]
+    assert rows['p'] == [['1', 'Web', '43'], ['2', 'Api', '44']]
+    assert rows['o'] == [['OO', 'Other One'], ['SP', 'Some P\xf8rson']]
+
+
+def test_index_does_not_hold_the_stories(tmpdir, monkeypatch):
+    monkeypatch.setattr('pivotal_tools.completion.MAX_STORIES', 2)
+    index = CompletionIndex(str(tmpdir.join('completion.tsv')))
+    for story_id in ['1', '2', '3']:
+        index.add(StoryFactory(story_id=story_id, project_id='43',
+                               name='Story {}'.format(story_id)))
+
+    assert list(index._stories) == [('2', 'SP', 'Story 2', '43'),
+                                    ('3', 'SP', 'Story 3', '43')]
+
+
+def test_scripts_complete_commands_and_options():
+    for shell in ['bash', 'zsh']:
+        script = completion_script(shell, ['--for', '--project-index'])
+        assert 'changelog' in script and '--project-index' in script
+        assert '__' not in script.replace('_pivotal_tools', '')
@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+import threading
+import time
+
+from pivotal_tools.concurrency import (
+    imap_concurrently, map_concurrently, Prefetch, WriteBehindQueue)
+
+
+def test_results_are_in_input_order():
+    def slow_for_small(n):
+        time.sleep(0.01 * (5 - n))
+        return n * 2
+
+    assert (map_concurrently(slow_for_small, range(5), max_workers=3)
+            == [(n, n * 2, None) for n in range(5)])
+
+
+def test_errors_do_not_abort_other_items():
+    def fail_on_odd(n):
+        if n % 2:
+            raise ValueError(n)
+        return n
+
+    results = map_concurrently(fail_on_odd, range(4))
+    assert [result for _, result, _ in results] == [0, None, 2, None]
+    assert [type(error) for _, _, error in results] == [
+        type(None), ValueError, type(None), ValueError]
+
+
+def test_items_are_read_lazily():
+    read = []
+
+    def items():
+        for n in range(100):
+            read.append(n)
+            yield n
+
+    results = imap_concurrently(lambda n: n, items(), max_workers=2)
+    next(results)
+    results.close()
+    assert len(read) < 10
+
+
+def test_write_behind_queue_retries_failures():
+    attempts = []
+
+    def flaky(value):
+        attempts.append(value)
+        if len(attempts) < 2:
+            raise IOError('connection reset')
+
+    queue = WriteBehindQueue(retry_delay=0)
+    queue.submit('flaky', flaky, 3)
+    queue.join()
+    assert attempts == [3, 3]
+    assert queue.pending == 0
+    assert queue.failed == []
+
+
+def test_write_behind_queue_gives_up():
+    def broken():
+        raise IOError('connection refused')
+
+    queue = WriteBehindQueue(retries=2, retry_delay=0)
+    queue.submit('broken', broken)
+    queue.join()
+    assert [description for description, _ in queue.failed] == ['broken']
+
+
+def test_prefetch_is_taken_for_its_key():
+    prefetch = Prefetch('43').start(lambda: 'report')
+    assert prefetch.take('43') == 'report'
+
+
+def test_prefetch_is_cancelled_for_another_key():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    class Project(object):
+        def first(self):
+            calls.append('first')
+            started.set()
+            release.wait()
+
+        def second(self):
+            calls.append('second')
+
+    def queries(project):
+        project.first()
+        project.second()
+
+    prefetch = Prefetch('43')
+    prefetch.start(queries, prefetch.guard(Project()))
+    started.wait()
+    assert prefetch.take('44') is None
+    release.set()
+    assert prefetch.take('43') is None
+    assert calls == ['first']
@@ -0,0 +1,83 @@
+from __future__ import unicode_literals
+import json
+
+from pivotal_tools.download import (
+    download_attachment, DOWNLOADED, RESUMED, UNCHANGED)
+
+BODY = b'0123456789' * 10
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeAttachment(object):
+    attachment_id = '7'
+    url = 'http://example.com/files/report.pdf'
+
+    def __init__(self, etag='"v1"'):
+        self.etag = etag
+        self.requests = []
+
+    def head(self):
+        return FakeResponse(200, headers={'ETag': self.etag,
+                                          'Content-Length': str(len(BODY))})
+
+    def open(self, offset=0, etag=None):
+        self.requests.append(offset)
+        if offset > 0 and etag == self.etag:
+            return FakeResponse(206, BODY[offset:])
+        return FakeResponse(200, BODY)
+
+
+def test_download_resume_and_skip(tmpdir):
+    path = str(tmpdir.join('42', '7-report.pdf'))
+    tmpdir.mkdir('42').join('7-report.pdf.part').write_binary(BODY[:30])
+    tmpdir.join('42', '7-report.pdf.part.meta').write(json.dumps({'etag': '"v1"'}))
+
+    attachment = FakeAttachment()
+    assert download_attachment(attachment, path) == RESUMED
+    assert tmpdir.join('42', '7-report.pdf').read_binary() == BODY
+    assert attachment.requests == [30]
+
+    assert download_attachment(attachment, path) == UNCHANGED
+    assert attachment.requests == [30]
+
+
+def test_download_changed_etag(tmpdir):
+    path = str(tmpdir.join('7-report.pdf'))
+    assert download_attachment(FakeAttachment(), path) == DOWNLOADED
+    assert download_attachment(FakeAttachment('"v2"'), path) == DOWNLOADED
+    assert tmpdir.join('7-report.pdf').read_binary() == BODY
+
+
+def test_download_without_etag_restarts(tmpdir):
+    path = str(tmpdir.join('7-report.pdf'))
+    tmpdir.join('7-report.pdf.part').write_binary(b'x' * 30)
+
+    attachment = FakeAttachment(None)
+    assert download_attachment(attachment, path) == DOWNLOADED
+    assert tmpdir.join('7-report.pdf').read_binary() == BODY
+    assert attachment.requests == [0]
+
+
+def test_download_of_a_newer_version_restarts(tmpdir):
+    path = str(tmpdir.join('7-report.pdf'))
+    tmpdir.join('7-report.pdf.part').write_binary(b'X' * 30)
+    tmpdir.join('7-report.pdf.part.meta').write(json.dumps({'etag': '"v1"'}))
+
+    attachment = FakeAttachment('"v2"')
+    assert download_attachment(attachment, path) == DOWNLOADED
+    assert tmpdir.join('7-report.pdf').read_binary() == BODY
+    assert attachment.requests == [0]
+    assert not tmpdir.join('7-report.pdf.part.meta').exists()
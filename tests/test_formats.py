@@ -0,0 +1,28 @@
+from __future__ import unicode_literals
+import io
+import json
+
+from pivotal_tools.formats import story_record, write_records
+
+from test_cli import StoryFactory
+
+
+def test_jsonl():
+    raw = io.BytesIO()
+    records = (story_record(StoryFactory(story_id=str(n)), 'Test', 'open')
+               for n in range(3))
+    stream = io.TextIOWrapper(raw)
+    write_records(records, 'jsonl', stream, chunk_size=2)
+
+    lines = raw.getvalue().decode('utf-8').splitlines()
+    assert [json.loads(line)['story_id'] for line in lines] == ['0', '1', '2']
+    assert json.loads(lines[0])['name'] == 'F\xf8\xf8'
+
+
+def test_tsv():
+    raw = io.BytesIO()
+    stream = io.TextIOWrapper(raw)
+    write_records([story_record(StoryFactory(), 'Test', 'bug')], 'tsv', stream)
+    assert raw.getvalue().decode('utf-8').splitlines() == [
+        'project\tsection\tstory_id\tstory_type\tstate\testimate\towned_by\tlabels\tname\turl',
+        'Test\tbug\t42\tbug\tstarted\t1\tSome P\xf8rson\t\tF\xf8\xf8\thttp://example.com']
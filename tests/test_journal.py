@@ -0,0 +1,92 @@
+from __future__ import unicode_literals
+
+import requests
+
+from pivotal_tools import journal
+from pivotal_tools.journal import Journal, dedupe
+
+
+def test_record_and_remove(tmpdir):
+    log = Journal(str(tmpdir.join('journal.jsonl')))
+    started = log.record_state('42', 'started', project_index='1')
+    finished = log.record_state('42', 'finished', project_index='1')
+
+    assert [entry['value'] for entry in log.entries()] == [
+        'started', 'finished']
+
+    log.remove([started['id']])
+    assert [entry['id'] for entry in log.entries()] == [finished['id']]
+
+
+def test_entries_skip_torn_writes(tmpdir):
+    path = tmpdir.join('journal.jsonl')
+    log = Journal(str(path))
+    log.record_estimate('42', 3)
+    path.write('{"action": "set_st', mode='a')
+
+    assert [entry['value'] for entry in log.entries()] == [3]
+
+
+def test_dedupe(tmpdir):
+    log = Journal(str(tmpdir.join('journal.jsonl')))
+    log.record_state('42', 'started')
+    log.record_state('42', 'started')
+    log.record_estimate('42', 1)
+    log.record_estimate('42', 3)
+    log.record_state('42', 'finished')
+
+    unique, duplicates = dedupe(log.entries())
+    assert [(entry['action'], entry['value']) for entry in unique] == [
+        (journal.SET_STATE, 'started'),
+        (journal.ASSIGN_ESTIMATE, 3),
+        (journal.SET_STATE, 'finished')]
+    assert len(duplicates) == 2
+
+
+def test_dedupe_keeps_estimates_a_state_change_needs(tmpdir):
+    log = Journal(str(tmpdir.join('journal.jsonl')))
+    log.record_estimate('42', 1)
+    log.record_state('42', 'started')
+    log.record_estimate('42', 3)
+
+    unique, duplicates = dedupe(log.entries())
+    assert [entry['value'] for entry in unique] == [1, 'started', 3]
+    assert duplicates == []
+
+
+class FailingProject(object):
+    project_id = '43'
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def create_story(self, story_dict):
+        response = requests.Response()
+        response.status_code = self.status_code
+        raise requests.HTTPError('{} Error'.format(self.status_code),
+                                 response=response)
+
+
+def test_flush_keeps_changes_that_were_refused(tmpdir, monkeypatch):
+    for status_code, conflicts, queued in [(401, 0, 1), (429, 0, 1), (422, 1, 0)]:
+        log = Journal(str(tmpdir.join('journal-{}.jsonl'.format(status_code))))
+        log.record_story({'story': {'name': 'New'}}, project_id='43')
+        monkeypatch.setattr(journal.Project, 'all', staticmethod(
+            lambda: [FailingProject(status_code)]))
+
+        result = journal.flush(log)
+        assert len(result.conflicts) == conflicts
+        assert len(log.entries()) == queued
+
+
+def test_flush_keeps_changes_without_a_project(tmpdir, monkeypatch):
+    log = Journal(str(tmpdir.join('journal.jsonl')))
+    log.record_story({'story': {'name': 'New'}})
+    log.record_story({'story': {'name': 'Other'}}, project_index='3')
+    monkeypatch.setattr(journal.Project, 'all', staticmethod(
+        lambda: [FailingProject(422), FailingProject(422)]))
+
+    result = journal.flush(log)
+    assert (len(result.conflicts), len(result.failed)) == (0, 2)
+    assert [entry['value']['story']['name'] for entry in log.entries()] == [
+        'New', 'Other']
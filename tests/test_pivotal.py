@@ -0,0 +1,209 @@
+from __future__ import unicode_literals
+import io
+import json
+
+from pivotal_tools import pivotal
+
+STORIES_XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<stories type="array" count="2" total="2">
+  <story>
+    <id type="integer">1</id>
+    <story_type>feature</story_type>
+    <name>First</name>
+    <estimate type="integer">2</estimate>
+    <current_state>started</current_state>
+    <notes type="array">
+      <note><id type="integer">5</id><text>A note</text><author>Some Person</author></note>
+    </notes>
+  </story>
+  <story>
+    <id type="integer">2</id>
+    <story_type>bug</story_type>
+    <name>Second</name>
+  </story>
+</stories>
+'''
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+        self.raw = io.BytesIO(content)
+
+    def close(self):
+        pass
+
+
+def test_iter_stories_streams(monkeypatch):
+    monkeypatch.setattr(pivotal, '_perform_pivotal_get',
+                        lambda url, **kwargs: FakeResponse(STORIES_XML))
+    project = pivotal.Project('43', 'Test', ['0', '1', '2'])
+
+    stories = project.iter_stories('state:started')
+    first = next(stories)
+    assert (first.story_id, first.estimate) == ('1', 2)
+    assert [note.text for note in first.notes] == ['A note']
+    assert [story.name for story in stories] == ['Second']
+
+
+class JsonResponse(FakeResponse):
+    def __init__(self, data, headers=None):
+        FakeResponse.__init__(self, json.dumps(data).encode('utf-8'))
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        pass
+
+
+def test_v5_stories_are_paged_and_projected(monkeypatch):
+    pages = [[{'id': 1, 'project_id': 43, 'name': 'First', 'story_type': 'feature',
+               'current_state': 'started', 'labels': [{'name': 'a'}, {'name': 'b'}],
+               'owners': [{'name': 'Some Person'}]}],
+             [{'id': 2, 'project_id': 43, 'name': 'Second', 'story_type': 'bug'}]]
+    urls = []
+
+    def get(url, **kwargs):
+        urls.append(url)
+        return JsonResponse(pages[len(urls) - 1],
+                            {'X-Tracker-Pagination-Total': '2'})
+
+    monkeypatch.setattr(pivotal, '_backend', pivotal.V5Backend())
+    monkeypatch.setattr(pivotal, '_perform_pivotal_get', get)
+    project = pivotal.Project('43', 'Test', ['0', '1', '2'])
+
+    first, second = project.open_stories()
+    assert (first.story_id, first.estimate, first.labels, first.owned_by) == (
+        '1', -1, 'a,b', 'Some Person')
+    assert (second.estimate, second.owned_by, second.summary) == (None, '', True)
+    assert 'fields=id,project_id,name,' in urls[0]
+    assert 'description' not in urls[0]
+    assert 'offset=1' in urls[1]
+
+
+def test_v5_story_details(monkeypatch):
+    story = {'id': 1, 'project_id': 43, 'name': 'First', 'story_type': 'bug',
+             'description': 'Broken',
+             'tasks': [{'id': 3, 'description': 'Fix', 'complete': True}],
+             'comments': [{'id': 5, 'text': 'A note', 'person': {'name': 'SP'},
+                           'file_attachments': [{'id': 7, 'filename': 'a.png',
+                                                 'download_url': '/file_attachments/7/download'}]}]}
+    monkeypatch.setattr(pivotal, '_backend', pivotal.V5Backend())
+    monkeypatch.setattr(pivotal, '_perform_pivotal_get',
+                        lambda url, **kwargs: JsonResponse(story))
+
+    loaded = pivotal.Project('43', 'Test', []).load_story('1')
+    assert (loaded.description, loaded.summary) == ('Broken', False)
+    assert [(note.text, note.author) for note in loaded.notes] == [('A note', 'SP')]
+    assert [task.complete for task in loaded.tasks] == [True]
+    assert loaded.attachments[0].url.endswith('/file_attachments/7/download')
+
+
+def test_iter_stories_does_not_keep_parsed_stories(monkeypatch):
+    stories_xml = (b'<stories>'
+                   + b''.join(b'<story><id>' + str(n).encode('ascii') + b'</id></story>'
+                              for n in range(1000))
+                   + b'</stories>')
+    roots = []
+    iterparse = pivotal.ET.iterparse
+
+    def recording_iterparse(source, events):
+        for event, node in iterparse(source, events):
+            if not roots:
+                roots.append(node)
+            yield event, node
+
+    monkeypatch.setattr(pivotal.ET, 'iterparse', recording_iterparse)
+    monkeypatch.setattr(pivotal, '_perform_pivotal_get',
+                        lambda url, **kwargs: FakeResponse(stories_xml))
+    project = pivotal.Project('43', 'Test', [])
+
+    assert len(list(project.iter_stories('state:started'))) == 1000
+    assert len(roots[0]) == 0
+
+
+class RedirectingTransport(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, headers=None, data=None, stream=False,
+                allow_redirects=True):
+        self.requests.append((url, dict(headers or {}), allow_redirects))
+        if url.endswith('/download'):
+            response = JsonResponse({}, {'Location': '/storage/report.pdf?signed=1'})
+            response.status_code = 302
+            return response
+        return JsonResponse({})
+
+
+def test_attachment_redirects_are_followed_without_the_token(monkeypatch):
+    transport = RedirectingTransport()
+    monkeypatch.setattr(pivotal, '_transport', transport)
+    monkeypatch.setattr(pivotal, 'TOKEN', 'secret')
+    attachment = pivotal.Attachment(
+        '7', 'report.pdf',
+        'https://www.pivotaltracker.com/file_attachments/7/download')
+
+    assert attachment.open(30, '"v1"').status_code == 200
+    (first_url, first, first_redirects), (url, headers, redirects) = transport.requests
+    assert first['X-TrackerToken'] == 'secret'
+    assert url == 'https://www.pivotaltracker.com/storage/report.pdf?signed=1'
+    assert 'X-TrackerToken' not in headers
+    assert headers['Range'] == 'bytes=30-'
+    assert not first_redirects and not redirects
+
+
+class SendingTransport(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, headers=None, data=None, stream=False,
+                allow_redirects=True):
+        self.requests.append((method, url, headers, data))
+        return JsonResponse({})
+
+
+def test_v5_updates_are_sent_as_json(monkeypatch):
+    transport = SendingTransport()
+    monkeypatch.setattr(pivotal, '_transport', transport)
+    monkeypatch.setattr(pivotal, '_backend', pivotal.V5Backend())
+    story = pivotal.Story()
+    story.project_id, story.story_id = '43', '1'
+
+    story.set_state('started')
+    story.assign_estimate('2')
+    pivotal.Project('43', 'Test', []).create_story(
+        {'story': {'name': 'New', 'story_type': 'chore', 'labels': 'a, b'}})
+
+    (state_method, state_url, state_headers, state_data), estimate, create = transport.requests
+    assert (state_method, state_url) == (
+        'PUT', 'https://www.pivotaltracker.com/services/v5/projects/43/stories/1')
+    assert state_headers['Content-type'] == 'application/json'
+    assert json.loads(state_data.decode('utf-8')) == {'current_state': 'started'}
+    assert estimate[0] == 'PUT'
+    assert json.loads(estimate[3].decode('utf-8')) == {'estimate': 2}
+
+    method, url, headers, data = create
+    assert (method, url) == (
+        'POST', 'https://www.pivotaltracker.com/services/v5/projects/43/stories')
+    assert headers['Content-type'] == 'application/json'
+    assert json.loads(data.decode('utf-8')) == {
+        'name': 'New', 'story_type': 'chore',
+        'labels': [{'name': 'a'}, {'name': 'b'}]}
+
+
+def test_v3_updates_are_sent_as_query_parameters(monkeypatch):
+    transport = SendingTransport()
+    monkeypatch.setattr(pivotal, '_transport', transport)
+    monkeypatch.setattr(pivotal, '_backend', pivotal.V3Backend())
+    story = pivotal.Story()
+    story.project_id, story.story_id = '43', '1'
+
+    story.set_state('started')
+    story.assign_estimate('2')
+
+    assert [(method, url, data) for method, url, headers, data in transport.requests] == [
+        ('PUT', 'https://www.pivotaltracker.com/services/v3/projects/43/stories/1'
+                '?story[current_state]=started', None),
+        ('PUT', 'https://www.pivotaltracker.com/services/v3/projects/43/stories/1'
+                '?story[estimate]=2', None)]
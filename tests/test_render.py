@@ -0,0 +1,23 @@
+from __future__ import unicode_literals
+import io
+
+from pivotal_tools import render
+
+
+def test_style_matches_termcolor():
+    assert render.COLOR.bold('F\xf8\xf8') == '\x1b[1m\x1b[37mF\xf8\xf8\x1b[0m'
+    assert render.PLAIN.bold('F\xf8\xf8') == 'F\xf8\xf8'
+
+
+def test_write_lines_is_one_write():
+    raw = io.BytesIO()
+    stream = io.TextIOWrapper(raw, encoding='utf-8')
+    render.write_lines(['F\xf8\xf8', 'bar'], clear=True, stream=stream)
+    assert raw.getvalue() == (
+        render.CLEAR_SCREEN + 'F\xf8\xf8\nbar\n').encode('utf-8')
+
+
+def test_terminal_size_without_a_terminal(monkeypatch):
+    monkeypatch.setenv('LINES', '40')
+    monkeypatch.setenv('COLUMNS', '120')
+    assert render.terminal_size(io.StringIO()) == (40, 120)
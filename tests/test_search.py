@@ -0,0 +1,120 @@
+from __future__ import unicode_literals
+import json
+
+from pivotal_tools.pivotal import Note, Task
+from pivotal_tools.search import SearchIndex
+
+from test_cli import StoryFactory
+
+
+def story(story_id, name, description='', labels='', notes=(), tasks=()):
+    return StoryFactory(story_id=story_id, name=name, description=description,
+                        labels=labels, notes=list(notes), tasks=list(tasks))
+
+
+def ids(results):
+    return [story_id for score, story_id, doc in results]
+
+
+def test_search_is_ranked_and_persisted(tmpdir):
+    path = str(tmpdir.join('index.json'))
+    index = SearchIndex(path)
+    index.add(story('1', 'Login page', description='users can login'))
+    index.add(story('2', 'Logout', notes=[Note('9', 'after login', 'SP')]))
+    index.add(story('3', 'Billing', tasks=[Task('8', 'Invoice', False)]))
+    index.save()
+
+    index = SearchIndex(path)
+    assert ids(index.search('login')) == ['1', '2']
+    assert sorted(ids(index.search('LOG*'))) == ['1', '2']
+    assert ids(index.search('invoice')) == ['3']
+    assert ids(index.search('login page')) == ['1']
+    assert ids(index.search('nothing')) == []
+
+
+def test_search_reindexes_changed_stories(tmpdir):
+    path = str(tmpdir.join('index.json'))
+    index = SearchIndex(path)
+    index.add(story('1', 'Login page'))
+    index.save()
+
+    index = SearchIndex(path)
+    index.add(story('1', 'Signup page'))
+    index.save()
+    assert ids(index.search('login')) == []
+    assert ids(index.search('signup')) == ['1']
+
+
+def test_summary_stories_keep_their_text(tmpdir):
+    path = str(tmpdir.join('index.json'))
+    index = SearchIndex(path)
+    index.add(story('1', 'Login page', description='users can login'))
+    index.save()
+
+    index = SearchIndex(path)
+    summary = story('1', 'Signup page', labels='auth')
+    summary.summary = True
+    index.add(summary)
+    index.save()
+    assert ids(index.search('users')) == ['1']
+    assert ids(index.search('signup auth')) == ['1']
+    assert ids(index.search('login')) == ['1']
+    assert ids(index.search('page')) == ['1']
+
+
+def test_unchanged_stories_do_not_rewrite_the_index(tmpdir, monkeypatch):
+    path = str(tmpdir.join('index.json'))
+    index = SearchIndex(path)
+    index.add(story('1', 'Login page', labels='auth'))
+    index.save()
+
+    writes = []
+    monkeypatch.setattr('pivotal_tools.search.write_atomically',
+                        lambda path, data: writes.append(path))
+    index = SearchIndex(path)
+    index.add(story('1', 'Login page', labels='auth'))
+    summary = story('1', 'Login page', labels='auth')
+    summary.summary = True
+    index.add(summary)
+    index.save()
+    assert writes == []
+
+
+def test_pending_stories_are_merged_past_the_cap(tmpdir, monkeypatch):
+    monkeypatch.setattr('pivotal_tools.search.MAX_PENDING', 3)
+    index = SearchIndex(str(tmpdir.join('index.json')))
+    for n in range(7):
+        index.add(story(str(n), 'Story {}'.format(n)))
+    assert len(index._added) == 1
+    assert len(index.docs) == 6
+
+
+def test_older_index_versions_are_rebuilt(tmpdir):
+    path = tmpdir.join('index.json')
+    path.write(json.dumps({'version': 1, 'postings': {'login': {'1': 3}},
+                           'docs': {'1': {'name': 'Login page', 'state': None,
+                                          'story_type': None}}}))
+
+    index = SearchIndex(str(path))
+    assert ids(index.search('login')) == []
+
+
+def test_indexes_saving_alternately_keep_each_others_stories(tmpdir):
+    path = str(tmpdir.join('index.json'))
+    listener = SearchIndex(path)
+    listener.add(story('1', 'Login page'))
+    listener.save()
+
+    other = SearchIndex(path)
+    other.add(story('2', 'Billing'))
+    other.save()
+
+    listener.apply('1', '43', {'state': 'finished'}, 'invoice login')
+    listener.save()
+    other.add(story('3', 'Invoices'))
+    other.save()
+
+    index = SearchIndex(path)
+    assert sorted(ids(index.search('invoice*'))) == ['1', '3']
+    assert ids(index.search('billing')) == ['2']
+    assert index.docs['1']['state'] == 'finished'
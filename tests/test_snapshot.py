@@ -0,0 +1,63 @@
+from __future__ import unicode_literals
+
+from pivotal_tools import cli
+from pivotal_tools.snapshot import Snapshot, snapshot_path
+
+from test_cli import StoryFactory
+
+
+def test_save_and_load(tmpdir):
+    path = str(tmpdir.join('snapshot.json.gz'))
+    Snapshot.from_stories('43', [StoryFactory(labels='api')]).save(path)
+
+    snapshot = Snapshot.load(path)
+    assert snapshot.project_id == '43'
+    assert snapshot.stories == {'42': ['started', 1, 'api']}
+    assert snapshot.changed([StoryFactory(labels='api')]) == []
+
+
+def test_changed():
+    snapshot = Snapshot.from_stories('43', [
+        StoryFactory(story_id='1'), StoryFactory(story_id='2')])
+    unchanged = StoryFactory(story_id='1')
+    moved = StoryFactory(story_id='2', state='finished')
+    new = StoryFactory(story_id='3')
+
+    assert snapshot.changed([unchanged, moved, new]) == [moved, new]
+    assert snapshot.updated([moved]).stories['2'] == ['finished', 1, None]
+
+
+def test_changelog_since(tmpdir, monkeypatch):
+    monkeypatch.setattr('pivotal_tools.storage.DATA_DIR', str(tmpdir))
+    Snapshot.from_stories('43', [
+        StoryFactory(story_id='1', story_type='feature', state='finished'),
+        StoryFactory(story_id='2', story_type='bug', state='started'),
+    ]).save(snapshot_path('43'))
+
+    filters = []
+
+    class Project(object):
+        project_id = '43'
+        name = 'Test'
+
+        def get_stories(self, filter_string, fields=None):
+            filters.append(filter_string)
+            return [
+                StoryFactory(story_id='1', story_type='feature', state='finished'),
+                StoryFactory(story_id='2', story_type='bug', state='finished'),
+                StoryFactory(story_id='3', story_type='feature', state='delivered'),
+            ]
+
+    arguments = {'--since': 'last', '--snapshot': 'last'}
+    results = cli.changelog_queries(Project(), arguments)
+    features, bugs, known_issues, _ = results
+    assert [story.story_id for story in features] == ['3']
+    assert [story.story_id for story in bugs] == ['2']
+    assert known_issues == []
+    assert filters[0].startswith('includedone:true modified_since:')
+
+    monkeypatch.setattr(cli, 'group_stories_by_label',
+                        lambda stories: {'': stories})
+    cli.render_changelog(Project(), results, arguments)
+    snapshot = Snapshot.load(snapshot_path('43'))
+    assert sorted(snapshot.stories) == ['1', '2', '3']
@@ -0,0 +1,51 @@
+from __future__ import unicode_literals
+
+import pytest
+
+from pivotal_tools import stats
+from pivotal_tools.stats import Stats, StoryColumns
+
+from test_cli import StoryFactory
+
+
+@pytest.fixture(params=['numpy', 'stdlib'])
+def columns(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(stats, 'numpy', None)
+
+    return StoryColumns.from_stories([
+        StoryFactory(story_type='feature', estimate=3, state='started',
+                     owned_by='Ann', labels='api,ui'),
+        StoryFactory(story_type='feature', estimate=1, state='accepted',
+                     owned_by='Bob', labels='api'),
+        StoryFactory(story_type='feature', estimate=-1, state='unstarted',
+                     owned_by=None, labels=''),
+        StoryFactory(story_type='bug', estimate=None, state='started',
+                     owned_by='Ann', labels=None),
+        StoryFactory(story_type='chore', estimate=-1, state='unstarted',
+                     owned_by=None, labels=None),
+    ])
+
+
+def test_stats(columns):
+    result = Stats(columns, ['0', '1', '2', '3'])
+    assert result.total == 5
+    assert result.points == 4
+    assert result.points_by_state == [
+        ('started', 3), ('accepted', 1), ('unstarted', 0)]
+    assert result.points_by_owner == [('Ann', 3), ('Bob', 1), ('', 0)]
+    assert result.points_by_label == [('api', 4), ('ui', 3)]
+    assert result.estimate_distribution == [(0, 0), (1, 1), (2, 0), (3, 1)]
+    assert result.unestimated == 1
+    assert result.unestimated_share == pytest.approx(1 / 3.0)
+    assert result.bugs_per_feature == pytest.approx(1 / 3.0)
+
+
+def test_no_stories():
+    result = Stats(StoryColumns(), ['1', '2'])
+    assert result.points == 0
+    assert result.points_by_state == []
+    assert result.unestimated_share == 0.0
+    assert result.bugs_per_feature is None
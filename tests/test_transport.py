@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+
+import pytest
+
+from pivotal_tools import pivotal
+from test_pivotal import STORIES_XML
+from pivotal_tools.transport import (
+    CassetteError, RecordingTransport, ReplayTransport)
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, headers=None, data=None, stream=False,
+                allow_redirects=True):
+        self.requests.append((method, url))
+        if url.endswith('/missing'):
+            return FakeResponse(404, b'')
+        return FakeResponse(200, STORIES_XML,
+                            {'Content-Type': 'application/xml',
+                             'Content-Encoding': 'gzip'})
+
+
+def test_replays_a_recorded_session(tmpdir, monkeypatch):
+    path = str(tmpdir.join('session.cassette'))
+    recording = RecordingTransport(path, FakeTransport())
+    monkeypatch.setattr(pivotal, '_transport', recording)
+    project = pivotal.Project('43', 'Test', ['0', '1', '2'])
+    recorded = [story.name for story in project.iter_stories('state:started')]
+    assert project.load_story('missing') is None
+    recording.close()
+
+    replay = ReplayTransport(path)
+    monkeypatch.setattr(pivotal, '_transport', replay)
+    assert [story.name for story in project.iter_stories('state:started')] == recorded
+    assert [story.name for story in project.get_stories('state:started')] == recorded
+    assert project.load_story('missing') is None
+
+    backend = pivotal.V3Backend()
+    response = replay.request('GET', backend.stories_url(project, 'state:started'))
+    assert response.headers['content-type'] == 'application/xml'
+    assert 'Content-Encoding' not in response.headers
+
+    with pytest.raises(CassetteError):
+        replay.request('GET', backend.stories_url(project, 'state:accepted'))
+    replay.close()
+
+
+def test_rejects_a_file_that_is_not_a_cassette(tmpdir):
+    path = tmpdir.join('other')
+    path.write_binary(b'not a cassette at all')
+    with pytest.raises(CassetteError):
+        ReplayTransport(str(path))
@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+import threading
+
+import requests
+
+from pivotal_tools.search import SearchIndex
+from pivotal_tools.webhook import make_server
+
+from test_cli import StoryFactory
+
+ACTIVITY_XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<activity>
+  <id type="integer">1031</id>
+  <version type="integer">175</version>
+  <event_type>story_update</event_type>
+  <occurred_at type="datetime">2013/10/27 19:41:26 UTC</occurred_at>
+  <author>Some Person</author>
+  <project_id type="integer">43</project_id>
+  <description>Some Person edited "Signup page"</description>
+  <stories type="array">
+    <story>
+      <id type="integer">42</id>
+      <url>https://www.pivotaltracker.com/services/v3/projects/43/stories/42</url>
+      <name>Signup page</name>
+      <current_state>delivered</current_state>
+    </story>
+  </stories>
+</activity>
+'''
+
+DELETE_XML = b'''<activity>
+  <event_type>story_delete</event_type>
+  <project_id type="integer">43</project_id>
+  <stories type="array"><story><id type="integer">42</id></story></stories>
+</activity>
+'''
+
+
+def post_activities(index, *activities):
+    server = make_server(index, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        return [requests.post(url, data=activity).status_code
+                for activity in activities]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_activity_updates_cached_story(tmpdir):
+    path = str(tmpdir.join('index.json'))
+    index = SearchIndex(path)
+    index.add(StoryFactory(name='Login page', description='with a form'))
+    index.save()
+
+    assert post_activities(SearchIndex(path), ACTIVITY_XML) == [200]
+
+    index = SearchIndex(path)
+    [(score, story_id, doc)] = index.search('signup')
+    assert doc['state'] == 'delivered'
+    assert index.search('login') == []
+    assert [result[1] for result in index.search('form')] == ['42']
+    assert index.project_for('42') == '43'
+
+
+def test_activity_deletes_and_rejects_garbage(tmpdir):
+    path = str(tmpdir.join('index.json'))
+    index = SearchIndex(path)
+    index.add(StoryFactory(name='Login page'))
+    index.save()
+
+    assert post_activities(SearchIndex(path), b'<activity', DELETE_XML) == [
+        400, 200]
+    assert SearchIndex(path).project_for('42') is None